@@ -0,0 +1,93 @@
+import random
+from lib import (
+    BULK_CHUNK_SIZE,
+    BULK_MAX_CHILDREN,
+    MAX_LITERAL_LENGTH,
+    DescendantColumns,
+    Descendants,
+    get_descendants_bulk,
+)
+
+
+class EgoGraph:
+    """
+    In-memory neighbourhood of a root entity: the filtered descendants of every
+    entity up to hops steps away, fetched in bulk with chunk_size entities
+    per query. At most max_nodes entities are expanded and each keeps at most
+    max_children children; when a hop reaches more entities, or an entity
+    has more children, a subset drawn from a root-seeded generator is kept.
+    Building the same root again repeats the same queries and samples, which
+    the SPARQL cache then serves, also offline.
+
+    Entities outside the neighbourhood are leaves, so sampling from it never
+    touches the network. With fetch_missing, get() fetches and keeps them
+    instead, one query each; misses counts those lookups either way.
+    """
+
+    def __init__(
+        self,
+        root,
+        hops=2,
+        max_nodes=500,
+        chunk_size=BULK_CHUNK_SIZE,
+        max_literal_length=MAX_LITERAL_LENGTH,
+        fetch_missing=False,
+        max_children=BULK_MAX_CHILDREN,
+    ):
+        self.root = root
+        self.hops = hops
+        self.max_nodes = max_nodes
+        self.chunk_size = chunk_size
+        self.max_literal_length = max_literal_length
+        self.fetch_missing = fetch_missing
+        self.max_children = max_children
+        self._rng = random.Random(root)
+        self.nodes = {}
+        self.misses = 0
+        self._build()
+
+    def __len__(self):
+        return len(self.nodes)
+
+    def __contains__(self, entity_code):
+        return entity_code in self.nodes
+
+    def __repr__(self):
+        edges = sum(len(descendants.children) for descendants in self.nodes.values())
+        return f"EgoGraph({self.root!r}, {len(self)} nodes, {edges} edges, misses={self.misses})"
+
+    def _fetch(self, entity_codes):
+        self.nodes.update(
+            get_descendants_bulk(entity_codes, self.chunk_size, self.max_literal_length, self.max_children, self._rng)
+        )
+
+    def _build(self):
+        frontier = [self.root]
+        for hop in range(self.hops + 1):
+            budget = self.max_nodes - len(self.nodes)
+            if not frontier or budget <= 0:
+                break
+            if len(frontier) > budget:
+                self._rng.shuffle(frontier)
+                frontier = frontier[:budget]
+            self._fetch(frontier)
+            if hop == self.hops:
+                break
+            seen = set(self.nodes)
+            next_frontier = []
+            for entity_code in frontier:
+                for qid in self.nodes[entity_code].children.qids:
+                    if qid and qid not in seen:
+                        seen.add(qid)
+                        next_frontier.append(qid)
+            frontier = next_frontier
+
+    def get(self, entity_code) -> Descendants:
+        descendants = self.nodes.get(entity_code)
+        if descendants is None:
+            self.misses += 1
+            if not self.fetch_missing:
+                return Descendants(entity_code, None, DescendantColumns())
+            self._fetch([entity_code])
+            descendants = self.nodes[entity_code]
+        return descendants
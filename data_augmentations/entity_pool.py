@@ -0,0 +1,184 @@
+"""
+Local pools of entity codes per class, to pick random root entities without
+querying the endpoint.
+
+harvest() collects the QID numbers of the instances of a class (wdt:P31)
+once, from the local WikidataStore when one is configured or with a single
+streamed SPARQL query, keeping a seeded uniform sample of classes larger
+than the limit, and EntityPool keeps them as sorted uint32 .npy files
+(4 bytes per entity) in pool_dir. Pools older than max_age are refreshed in
+a background thread while the old one keeps serving samples.
+"""
+import os
+import random
+import threading
+import time
+import numpy as np
+from lib import client, get_store
+
+# pool name -> class entity code
+CLASSES = {
+    "human": "Q5",
+    "organization": "Q43229",
+    "planet": "Q634",
+    "animal": "Q16521",
+}
+DEFAULT_POOL_DIR = "entity_pool"
+# instances kept per class, a million humans is 4 MB and one query
+HARVEST_LIMIT = 1_000_000
+ENTITY_PREFIX = "http://www.wikidata.org/entity/Q"
+
+instances_query = """
+SELECT ?entity WHERE {{
+  ?entity wdt:P31 wd:{class_code} .
+}}
+"""
+
+
+def harvest(class_code, limit=HARVEST_LIMIT, seed=0) -> np.ndarray:
+    """
+    Sorted unique QID numbers of the instances of class_code, a uniform
+    sample of limit of them drawn with seed when there are more. Without a
+    store every instance is streamed once, through a reservoir of limit ids.
+    """
+    limit = int(limit)
+    store = get_store()
+    if store is not None:
+        ids = store.instances(class_code)
+        if len(ids) > limit:
+            ids = np.sort(np.random.default_rng(seed).choice(ids, size=limit, replace=False))
+        return ids.astype(np.uint32)
+
+    rng = random.Random(seed)
+    ids = np.empty(limit, dtype=np.uint32)
+    seen = 0
+    for binding in client.iter_bindings(instances_query.format(class_code=class_code)):
+        value = binding["entity"]["value"]
+        if not value.startswith(ENTITY_PREFIX):
+            continue
+        if seen < limit:
+            ids[seen] = int(value[len(ENTITY_PREFIX) :])
+        else:
+            idx = rng.randrange(seen + 1)
+            if idx < limit:
+                ids[idx] = int(value[len(ENTITY_PREFIX) :])
+        seen += 1
+    return np.unique(ids[: min(seen, limit)])
+
+
+class EntityPool:
+    """
+    Seeded uniform sampling of entity codes from harvested per-class pools.
+
+    classes maps pool names to class entity codes and extends CLASSES, e.g.
+    {"mountain": "Q8502"}. A pool that is missing on disk is harvested on its
+    first use; one older than max_age seconds (None never expires) is served
+    as it is while refresh() rebuilds it in the background. Classes with more
+    than limit instances keep a uniform sample of them drawn with seed.
+    """
+
+    def __init__(self, pool_dir=DEFAULT_POOL_DIR, classes=None, max_age=30 * 24 * 3600, limit=HARVEST_LIMIT, seed=0):
+        self.pool_dir = pool_dir
+        self.classes = {**CLASSES, **(classes or {})}
+        self.max_age = max_age
+        self.limit = limit
+        self.seed = seed
+        os.makedirs(pool_dir, exist_ok=True)
+        self._pools = {}
+        self._refreshing = {}
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        sizes = ", ".join(f"{name}={len(ids)}" for name, ids in self._pools.items())
+        return f"EntityPool({self.pool_dir!r}, {sizes})"
+
+    def path(self, name):
+        return os.path.join(self.pool_dir, f"{name}.{self.classes[name]}.npy")
+
+    def _save(self, name, ids):
+        path = self.path(name)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as f:
+            np.save(f, ids)
+        os.replace(tmp_path, path)
+
+    def _harvest(self, name):
+        ids = harvest(self.classes[name], self.limit, self.seed)
+        self._save(name, ids)
+        with self._lock:
+            self._pools[name] = ids
+        return ids
+
+    def _refresh_worker(self, names):
+        for name in names:
+            try:
+                self._harvest(name)
+            except Exception as e:
+                print(f"Could not refresh entity pool {name}: {e}")
+            finally:
+                with self._lock:
+                    self._refreshing.pop(name, None)
+
+    def refresh(self, names=None, background=True):
+        """
+        Harvest the given pools (all by default) again. In the background the
+        thread is returned and pools that are already being refreshed are
+        skipped; samples come from the old pool until the new one is saved.
+        """
+        names = list(self.classes if names is None else names)
+        if not background:
+            for name in names:
+                self._harvest(name)
+            return None
+        with self._lock:
+            names = [name for name in names if name not in self._refreshing]
+            if not names:
+                return None
+            thread = threading.Thread(target=self._refresh_worker, args=(names,), name="entity-pool-refresh")
+            for name in names:
+                self._refreshing[name] = thread
+        thread.start()
+        return thread
+
+    def load(self, name) -> np.ndarray:
+        """QID numbers of pool name, harvested now when there is no pool file yet."""
+        with self._lock:
+            ids = self._pools.get(name)
+        if ids is not None:
+            return ids
+        if name not in self.classes:
+            raise KeyError(f"Unknown entity pool {name!r}, choose from {sorted(self.classes)}")
+        path = self.path(name)
+        if not os.path.exists(path):
+            return self._harvest(name)
+        ids = np.load(path, mmap_mode="r")
+        with self._lock:
+            ids = self._pools.setdefault(name, ids)
+        if self.max_age is not None and time.time() - os.path.getmtime(path) > self.max_age:
+            self.refresh([name])
+        return ids
+
+    def sample(self, name, k, seed=None) -> list:
+        """k distinct entity codes drawn uniformly from pool name, fewer when it is smaller."""
+        ids = self.load(name)
+        rng = np.random.default_rng(seed)
+        idx = rng.choice(len(ids), size=min(k, len(ids)), replace=False)
+        return [f"Q{qid}" for qid in np.asarray(ids)[idx].tolist()]
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Harvest entity pools for the graph generators")
+    parser.add_argument("names", nargs="*", help="pools to harvest, all by default")
+    parser.add_argument("--pool-dir", default=DEFAULT_POOL_DIR, type=str)
+    parser.add_argument("--class", dest="classes", action="append", default=[], help="extra pool as name=Q123")
+    parser.add_argument("--limit", default=HARVEST_LIMIT, type=int)
+    parser.add_argument("--seed", default=0, type=int, help="seed of the sample of classes larger than --limit")
+    args = parser.parse_args()
+
+    pool = EntityPool(
+        args.pool_dir, dict(item.split("=", 1) for item in args.classes), limit=args.limit, seed=args.seed
+    )
+    pool.refresh(args.names or None, background=False)
+    print(pool)
@@ -1,49 +1,29 @@
-import random
 import time
-from SPARQLWrapper import SPARQLWrapper, JSON
+from entity_pool import EntityPool
 from grapher import Grapher, BlockTransformer
 
 
-def _graph(entity_code):
+def _graph(entity_code, variants=1):
     try:
         start = time.time()
         graph = Grapher(entity_code)
-        graph.randomize_graph()
-        graph.export()
+        if variants == 1:
+            graph.randomize_graph()
+            graph.export()
+        else:
+            # one bulk fetch of the neighbourhood, then every variant is sampled offline
+            graph.prefetch()
+            for seed in range(variants):
+                graph.randomize_graph(seed=seed)
+                graph.export(f"{entity_code}_{seed}")
         end = time.time()
         print(f"Graph exported successfully! Time taken: {end - start:.2f} seconds")
     except Exception as e:
         print(f"Error generating graph: {e}")
 
 
-def fetch_random_entity_codes(sparql_query, limit=50):
-    sparql = SPARQLWrapper("https://query.wikidata.org/sparql")
-    # Generate a random offset for retrieval
-    offset = random.randint(0, 1000)  # Adjust the range as needed
-    sparql_query = sparql_query.replace("{offset}", str(offset))  # Insert random offset
-    sparql.setQuery(sparql_query.format(limit=limit))
-    sparql.setReturnFormat(JSON)
-    results = sparql.query().convert()
-
-    entity_codes = []
-    for result in results["results"]["bindings"]:
-        entity_url = result["entity"]["value"]
-        entity_code = entity_url.split("/")[-1]
-        entity_codes.append(entity_code)
-
-    return entity_codes
-
-
-human_query_with_offset = """
-SELECT ?entity
-WHERE {{
-  ?entity wdt:P31 wd:Q5.  # Instances of humans
-}}
-LIMIT {limit}
-OFFSET {offset}
-"""
-
-entity_codes = fetch_random_entity_codes(human_query_with_offset, limit=10)
+# roots are drawn from the local pool, pass a seed to repeat a batch
+entity_codes = EntityPool().sample("human", 10)
 
 for entity_code in entity_codes:
     _graph(entity_code)
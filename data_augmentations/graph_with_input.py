@@ -1,7 +1,10 @@
 from grapher import Grapher
 from lib import verify_entity_code, verify_label
+import re
 import time
 
+ENTITY_CODE_PATTERN = re.compile(r"[QP]\d+")
+
 
 def _graph(entity_code):
     try:
@@ -24,10 +27,14 @@ def main():
             print("Exiting program. Goodbye!")
             break
 
-        # Check if input is a valid label or entity code
-        entity_code = verify_label(input_value) or (
-            verify_entity_code(input_value) and input_value
-        )
+        # Check if input is a valid label or entity code, only inputs shaped
+        # like an entity code (Q42, P31) need the extra round trip
+        if ENTITY_CODE_PATTERN.fullmatch(input_value):
+            entity_code = (
+                verify_entity_code(input_value) and input_value
+            ) or verify_label(input_value)
+        else:
+            entity_code = verify_label(input_value)
 
         if entity_code:
             print(f"Processing input: {input_value}")
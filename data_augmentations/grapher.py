@@ -1,14 +1,22 @@
-from lib import get_direct_descendents, get_label
+from lib import get_direct_descendents, get_label, sample_direct_descendents
+from ego_graph import EgoGraph
+from image_urls import get_detector
 from pathlib import Path
 from annotations import generate_annotations_with_bboxes
 import numpy as np
-import requests
 import validators
 import subprocess
 import random
 
 
 class Grapher:
+    # children fetched per expanded entity, sample_children looks at no more
+    # than a few of them
+    max_descendants = 64
+    # True: the endpoint filters and samples the children (max_descendants rows
+    # are transferred), False: all claims are streamed and sampled locally
+    server_sampling = True
+
     def __init__(self, entity_code):
         self.graph = "graph TD"
         self.root_entity_code = entity_code
@@ -20,6 +28,11 @@ class Grapher:
         self.triplets = set()
         self.explored = set()
         self.edges = set()
+        # set by prefetch(), randomize_graph then runs without network access
+        self.ego_graph = None
+        # random sources of the current randomize_graph call
+        self.np_random = np.random
+        self.random = random
 
     def reset(self):
         self.graph = "graph TD"
@@ -30,34 +43,30 @@ class Grapher:
         self.explored = set()
         self.edges = set()
 
-    def is_image_url(self, string: str):
-        try:
-            headers = {
-                "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36"
-            }
-            response = requests.get(url=string, headers=headers)
-            if response.status_code == 200:
-                content_type = response.headers.get("content-type")
-                return content_type.startswith("image/")
-        except requests.RequestException:
-            return False
-
     def validate_url(self, entity_label: str):
         return validators.url(entity_label)
 
     def is_image_url(self, url: str) -> bool:
-        """Checks if a given URL points to a valid image."""
-        try:
-            headers = {
-                "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36"
-            }
-            response = requests.get(url=url, headers=headers)
-            if response.status_code == 200:
-                content_type = response.headers.get("content-type")
-                return content_type.startswith("image/")
-        except requests.RequestException:
-            return False
-        return False
+        """Checks if a given URL points to a valid image, see image_urls.ImageUrlDetector."""
+        return get_detector().is_image_url(url)
+
+    def prefetch(self, hops=2, max_nodes=500, fetch_missing=False):
+        """
+        Fetch the hops-step neighbourhood of the root, at most max_nodes
+        entities, in a few bulk queries. Later randomize_graph calls sample
+        from it instead of querying every expanded entity again, so use it
+        when generating many diagrams of one root. Entities outside it are
+        leaves unless fetch_missing, see EgoGraph.
+        """
+        self.ego_graph = EgoGraph(self.root_entity_code, hops, max_nodes, fetch_missing=fetch_missing)
+        return self.ego_graph
+
+    def fetch_descendants(self, entity_code):
+        if self.ego_graph is not None:
+            return self.ego_graph.get(entity_code)
+        if self.server_sampling:
+            return sample_direct_descendents(entity_code, self.max_descendants, rng=self.random)
+        return get_direct_descendents(entity_code, sample=self.max_descendants, rng=self.random)
 
     def format_entity_label(self, entity_label: str):
         """
@@ -80,32 +89,25 @@ class Grapher:
     def sample_children(
         self, parent, children, max_children_per_parent=3, accept_images=False
     ) -> list:
-        num_children_to_sample = np.random.randint(1, max_children_per_parent)
+        num_children_to_sample = self.np_random.randint(1, max_children_per_parent)
 
         num_children = len(children)
         children_sampled = []
-        explored = set()
         limit = max_children_per_parent * 5
-
-        while (
-            num_children_to_sample > 0
-            and num_children_to_sample <= len(children)
-            and limit > 0
-            and num_children > 0
-        ):
-            idx = np.random.randint(num_children)
-            if idx in explored:
-                continue
-
-            explored.add(idx)
+        if num_children_to_sample > num_children:
+            return children_sampled
+
+        # every child is looked at most once, in random order, so the loop ends
+        # even when all children are literals or URLs
+        for idx in self.np_random.permutation(num_children).tolist():
+            if num_children_to_sample <= 0 or limit <= 0:
+                break
             subject = children[idx]
-            child = subject["value"]
-            relation = subject["property"]
+            child = subject.value
+            relation = subject.property
 
-            # if descendent is a URL that is not an image, continue because we don't want to add it to the graph
-            if self.is_image_url(child) and not accept_images:
-                continue
-            elif self.validate_url(child):
+            # if descendent is a URL that is not an accepted image, continue because we don't want to add it to the graph
+            if self.validate_url(child) and not (accept_images and self.is_image_url(child)):
                 continue
 
             # sometimes the nodes connect to themselves, so we don't want to add them to the graph
@@ -126,7 +128,7 @@ class Grapher:
                 self.edges.add((self.vertices[parent], self.vertices[child]))
 
             # if descendent is not a passable entity, then do not add to sample list
-            child_entity_code = subject["qid"]
+            child_entity_code = subject.qid
             if child_entity_code:
                 children_sampled.append(child_entity_code)
                 num_children_to_sample -= 1
@@ -134,26 +136,37 @@ class Grapher:
 
         return children_sampled
 
-    def randomize_graph(self, max_depth=10):
+    def seed(self, seed=None):
+        """Use generators seeded with seed, or the global ones when seed is None."""
+        if seed is None:
+            self.np_random = np.random
+            self.random = random
+        else:
+            self.np_random = np.random.RandomState(seed)
+            self.random = random.Random(seed)
+
+    def randomize_graph(self, max_depth=10, seed=None):
         self.reset()
+        self.seed(seed)
         queue = [self.root_entity_code]
         explored_entities = set()
         depth = 0
 
         while queue != [] and depth < max_depth:
             parent = queue.pop(0)
-            explored_entities.add(parent)
             if parent in explored_entities:
                 continue
-            children = get_direct_descendents(parent)
-            if not children or len(children) == 0:
+            explored_entities.add(parent)
+            descendants = self.fetch_descendants(parent)
+            if not descendants.children:
                 continue
 
-            parent_label = get_label(parent)
+            # the descendant query also returns the parent's label
+            parent_label = descendants.label
             if not parent_label or not parent:
                 continue
 
-            children_sampled = self.sample_children(parent_label, children)
+            children_sampled = self.sample_children(parent_label, descendants.children)
             queue += children_sampled
             depth += 1
 
@@ -164,7 +177,8 @@ class Grapher:
         for triplet in self.triplets:
             self.add_triplet_to_graph(triplet)
 
-    def export(self):
+    def export(self, name=None):
+        """Write the graph as name.md/.svg/.png/.xml, name defaults to the root entity code."""
         output_folder = Path.cwd() / "output"
         output_folder.mkdir(parents=True, exist_ok=True)
 
@@ -180,10 +194,11 @@ class Grapher:
         annotations_folder = output_folder / "annotations"
         annotations_folder.mkdir(parents=True, exist_ok=True)
 
-        md_file = f"{self.root_entity_code}.md"
-        img_file = f"{self.root_entity_code}.png"
-        svg_file = f"{self.root_entity_code}.svg"
-        annotations_file = f"{self.root_entity_code}.xml"
+        name = name or self.root_entity_code
+        md_file = f"{name}.md"
+        img_file = f"{name}.png"
+        svg_file = f"{name}.svg"
+        annotations_file = f"{name}.xml"
 
         file_path = markdown_folder / md_file
         image_path = images_folder / img_file
@@ -220,13 +235,13 @@ class BlockTransformer(Grapher):
     def transform_block(self, node):
         """Transform node based on its type (leaf or non-leaf)."""
         if self.root == node:
-            return random.choices(["Terminator", "Process"], weights=[0.8, 0.2], k=1)[0]
+            return self.random.choices(["Terminator", "Process"], weights=[0.8, 0.2], k=1)[0]
         if not self.has_children(node):
             # Randomize leaf nodes: 50/50 chance of being Terminator or Process
-            return random.choice(["Terminator", "Process"])
+            return self.random.choice(["Terminator", "Process"])
         else:
             # Non-leaf nodes: probabilities for Process, Data, Decision, and Connection
-            return random.choices(
+            return self.random.choices(
                 ["Process", "Data", "Decision", "Connection"],
                 weights=[0.4, 0.2, 0.2, 0.2],
                 k=1,
@@ -276,8 +291,9 @@ class BlockTransformer(Grapher):
 
         self.graph += f'\n    {parent_node} -- "{relation}" --> {child_node}'
 
-    def randomize_graph(self, max_depth=10):
+    def randomize_graph(self, max_depth=10, seed=None):
         self.reset()
+        self.seed(seed)
         queue = [self.root_entity_code]
         explored_entities = set()
         depth = 0
@@ -288,14 +304,14 @@ class BlockTransformer(Grapher):
                 continue
             explored_entities.add(parent)
 
-            children = get_direct_descendents(parent)
-            if not children or len(children) == 0:
+            descendants = self.fetch_descendants(parent)
+            if not descendants.children:
                 continue
 
-            parent_label = get_label(parent)
+            parent_label = descendants.label
             print(parent, parent_label)
 
-            children_sampled = self.sample_children(parent_label, children)
+            children_sampled = self.sample_children(parent_label, descendants.children)
             queue += children_sampled
             depth += 1
 
@@ -0,0 +1,152 @@
+import os
+import sqlite3
+import threading
+import time
+from urllib.parse import unquote, urlsplit
+import requests
+from requests.adapters import HTTPAdapter
+
+DEFAULT_CACHE_PATH = os.environ.get("WD_IMAGE_URL_CACHE", "image_url_cache.sqlite")
+USER_AGENT = "block-diagram-augmentations/1.0 python-requests"
+IMAGE_EXTENSIONS = {".png", ".jpg", ".jpeg", ".gif", ".svg", ".webp", ".bmp", ".tif", ".tiff", ".ico"}
+# servers that reject HEAD answer one of these, they get a 1-byte GET instead
+HEAD_UNSUPPORTED = {403, 405, 501}
+# the only error answers that are cached, anything else may succeed later
+GONE_STATUS_CODES = {404, 410}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS image_urls (
+    url TEXT PRIMARY KEY,
+    is_image INTEGER NOT NULL,
+    accessed REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS image_urls_accessed ON image_urls (accessed);
+"""
+
+
+def guess_image_url(string: str):
+    """
+    True or False when string alone decides whether it is an image URL, None
+    when only the server can tell. Strings that are not http(s) URLs are never
+    images and URLs whose path ends in an image extension always are.
+    """
+    if not string[:8].lower().startswith(("http://", "https://")):
+        return False
+    path = unquote(urlsplit(string).path).lower()
+    if os.path.splitext(path)[1] in IMAGE_EXTENSIONS:
+        return True
+    return None
+
+
+class ImageUrlDetector:
+    """
+    Tells whether a URL points to an image from its Content-Type, without
+    downloading the body.
+
+    Strings guess_image_url decides are answered locally. Other URLs get a
+    HEAD request, or a GET of the first byte when the server rejects HEAD, on
+    one pooled session shared by all threads. Answers are memoised in an
+    SQLite file at cache_path (None keeps them in memory only) that holds the
+    max_entries most recently used URLs. Only definitive answers are stored:
+    2xx responses and 404/410. Other statuses (429, 5xx, a 403 to both
+    requests), connection errors and timeouts count as not an image and are
+    not cached, so they are retried by the next lookup.
+    """
+
+    def __init__(self, cache_path=DEFAULT_CACHE_PATH, max_entries=100_000, timeout=(3.05, 10.0), user_agent=USER_AGENT):
+        self.cache_path = cache_path
+        self.max_entries = max_entries
+        self.timeout = timeout
+        self.hits = 0
+        self.misses = 0
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=8, pool_maxsize=16)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.session.headers.update({"User-Agent": user_agent})
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(cache_path or ":memory:", check_same_thread=False)
+        self._connection.executescript(SCHEMA)
+        self._count = self._connection.execute("SELECT COUNT(*) FROM image_urls").fetchone()[0]
+
+    def close(self):
+        self.session.close()
+        with self._lock:
+            self._connection.close()
+
+    def __repr__(self):
+        return f"ImageUrlDetector({self.cache_path!r}, {self._count} urls, hits={self.hits}, misses={self.misses})"
+
+    def _get(self, url):
+        with self._lock:
+            row = self._connection.execute("SELECT is_image FROM image_urls WHERE url = ?", (url,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            with self._connection:
+                self._connection.execute("UPDATE image_urls SET accessed = ? WHERE url = ?", (time.time(), url))
+            self.hits += 1
+        return bool(row[0])
+
+    def _put(self, url, is_image):
+        with self._lock, self._connection:
+            old = self._connection.execute("SELECT 1 FROM image_urls WHERE url = ?", (url,)).fetchone()
+            self._connection.execute(
+                "INSERT OR REPLACE INTO image_urls VALUES (?, ?, ?)", (url, int(is_image), time.time())
+            )
+            self._count += old is None
+            if self._count > self.max_entries:
+                # down to 90% so inserts at the limit do not evict every time
+                excess = self._count - int(self.max_entries * 0.9)
+                self._connection.execute(
+                    "DELETE FROM image_urls WHERE url IN (SELECT url FROM image_urls ORDER BY accessed LIMIT ?)",
+                    (excess,),
+                )
+                self._count = self._connection.execute("SELECT COUNT(*) FROM image_urls").fetchone()[0]
+
+    def _content_type(self, url):
+        """Content-Type of url, "" when it is gone, None when the server gave no definitive answer."""
+        response = self.session.head(url, timeout=self.timeout, allow_redirects=True)
+        if response.status_code in HEAD_UNSUPPORTED or (
+            response.status_code == 200 and not response.headers.get("content-type")
+        ):
+            response = self.session.get(
+                url, headers={"Range": "bytes=0-0"}, timeout=self.timeout, allow_redirects=True, stream=True
+            )
+            # only the headers are read, closing drops the rest of a server that ignores Range
+            response.close()
+        if 200 <= response.status_code < 300:
+            return response.headers.get("content-type", "")
+        if response.status_code in GONE_STATUS_CODES:
+            return ""
+        return None
+
+    def is_image_url(self, string: str) -> bool:
+        guess = guess_image_url(string)
+        if guess is not None:
+            return guess
+        is_image = self._get(string)
+        if is_image is not None:
+            return is_image
+        try:
+            content_type = self._content_type(string)
+        except requests.RequestException:
+            return False
+        if content_type is None:
+            return False
+        is_image = content_type.startswith("image/")
+        self._put(string, is_image)
+        return is_image
+
+
+_detector = None
+_detector_lock = threading.Lock()
+
+
+def get_detector() -> ImageUrlDetector:
+    """The detector shared by all graphers of the process."""
+    global _detector
+    with _detector_lock:
+        if _detector is None:
+            _detector = ImageUrlDetector()
+        return _detector
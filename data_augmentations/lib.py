@@ -1,7 +1,28 @@
-from SPARQLWrapper import SPARQLWrapper, JSON
-from SPARQLWrapper.SPARQLExceptions import EndPointInternalError
+import os
+import random
+import re
+import threading
+from typing import NamedTuple, Optional
+from sparql_cache import OfflineCacheMiss, SparqlCache
+from sparql_client import SparqlClient, SparqlError
+from wikidata_store import WikidataStore
 
-sparql = SPARQLWrapper("https://query.wikidata.org/bigdata/namespace/wdq/sparql")
+# shared by all threads, pools connections and keeps within Wikidata's rate limits
+client = SparqlClient()
+
+# responses are cached on disk, WD_SPARQL_CACHE="" disables the cache and
+# WD_OFFLINE=1 only replays cached responses, see configure_cache
+DEFAULT_CACHE_PATH = os.environ.get("WD_SPARQL_CACHE", "sparql_cache.sqlite")
+_cache = None
+_cache_configured = False
+_cache_lock = threading.Lock()
+
+# with a local store (see wikidata_store.py and configure_store) labels and
+# descendants are read from disk and the endpoint is never queried for them
+DEFAULT_STORE_PATH = os.environ.get("WD_STORE", "")
+_store = None
+_store_configured = False
+_store_lock = threading.Lock()
 
 entity_code_to_label_query = """
 PREFIX rdfs: <http://www.w3.org/2000/01/rdf-schema#> 
@@ -14,6 +35,21 @@ WHERE {{
 LIMIT 1
 """
 
+entity_codes_to_labels_query = """
+PREFIX rdfs: <http://www.w3.org/2000/01/rdf-schema#> 
+PREFIX wd: <http://www.wikidata.org/entity/> 
+SELECT  ?qid ?label
+WHERE {{
+        VALUES ?item {{ {items} }}
+        ?item rdfs:label ?label .
+        FILTER (langMatches( lang(?label), "EN" ) )
+        BIND(STRAFTER(STR(?item), STR(wd:)) AS ?qid) .
+      }}
+"""
+
+# QIDs per VALUES query, keeps the query text well below the endpoint's URL limits
+LABEL_CHUNK_SIZE = 200
+
 label_to_entity_code_query = """
 PREFIX rdfs: <http://www.w3.org/2000/01/rdf-schema#> 
 PREFIX wd: <http://www.wikidata.org/entity/> 
@@ -25,12 +61,27 @@ WHERE {{
 LIMIT 1
 """
 
-direct_descendents_query = """
-SELECT ?qid ?valueLabel ?propLabel  WHERE {{
+# literal objects longer than this are not sampled, they make unreadable nodes
+MAX_LITERAL_LENGTH = 40
+URL_PATTERN = re.compile(r"^[a-z]+://", re.IGNORECASE)
+# entities per bulk descendant query, hubs return thousands of rows each
+BULK_CHUNK_SIZE = 25
+# children kept per entity by get_descendants_bulk, a uniform sample on hubs
+BULK_MAX_CHILDREN = 256
+# distinct server-side samples per entity, see sample_direct_descendents
+SAMPLE_SEEDS = 16
+
+# graph pattern shared by the full and the sampled descendant queries
+descendents_pattern = """
   VALUES ?item {{
     wd:{entity_code}
   }}
   ?item ?a ?value.
+  # English label of the item itself, saves a get_label round trip
+  OPTIONAL {{
+    ?item rdfs:label ?parentName .
+    FILTER (lang(?parentName) = "en")
+  }}
   # remove wikimedia items
   MINUS {{
     ?item wdt:P31 wd:Q4167836
@@ -62,20 +113,162 @@ SELECT ?qid ?valueLabel ?propLabel  WHERE {{
   FILTER (?prop != wd:P301) # category's main topic
   FILTER (?prop != wd:P5125) # category's main topic
   SERVICE wikibase:label {{ bd:serviceParam wikibase:language "en". }}
+"""
+
+direct_descendents_query = (
+    """
+SELECT ?qid ?valueLabel ?propLabel ?parentName  WHERE {{"""
+    + descendents_pattern
+    + """  }}
+"""
+)
+
+# only entities and short literals that are not URLs or the item itself
+descendents_filter = """  FILTER (?value != ?item)
+  FILTER (
+    (isIRI(?value) && STRSTARTS(STR(?value), STR(wd:)))
+    || (isLiteral(?value) && STRLEN(STR(?value)) <= {max_literal_length} && !REGEX(STR(?value), "^[a-z]+://", "i"))
+  )
+"""
+
+# same children, filtered and sampled by the endpoint, ordered by a seeded hash
+# so a (seed, limit) pair always selects the same rows and can be cached
+sampled_descendents_query = (
+    """
+SELECT ?qid ?valueLabel ?propLabel ?parentName  WHERE {{"""
+    + descendents_pattern
+    + descendents_filter
+    + """  BIND(MD5(CONCAT(STR(?a), STR(?value), "{seed}")) AS ?rank)
+  }}
+ORDER BY ?rank
+LIMIT {limit}
+"""
+)
+
+
+# filtered children of many items at once, ?itemQid tells the items apart
+bulk_descendents_query = (
+    """
+SELECT ?itemQid ?qid ?valueLabel ?propLabel ?parentName  WHERE {{"""
+    + descendents_pattern.replace("wd:{entity_code}", "{items}")
+    + descendents_filter
+    + """  BIND(STRAFTER(STR(?item), STR(wd:)) AS ?itemQid) .
   }}
 """
+)
+
+
+def configure_cache(path=DEFAULT_CACHE_PATH, ttl=30 * 24 * 3600, max_bytes=1 << 30, offline=False):
+    """
+    Set the SPARQL response cache used by query_wd. path=None disables it.
+    offline=True never contacts the endpoint and raises OfflineCacheMiss for
+    queries that were not cached before.
+    """
+    global _cache, _cache_configured
+    with _cache_lock:
+        if _cache is not None:
+            _cache.close()
+        _cache = SparqlCache(path, ttl, max_bytes, offline) if path else None
+        _cache_configured = True
+    return _cache
+
+
+def get_cache():
+    """The response cache, created from the environment on first use."""
+    global _cache, _cache_configured
+    if not _cache_configured:
+        # checked again under the lock: threads racing on their first query
+        # must share one cache, and a cache other threads hold is never closed
+        with _cache_lock:
+            if not _cache_configured:
+                offline = os.environ.get("WD_OFFLINE", "") not in ("", "0")
+                _cache = SparqlCache(DEFAULT_CACHE_PATH, offline=offline) if DEFAULT_CACHE_PATH else None
+                _cache_configured = True
+    return _cache
+
+
+def configure_store(path=DEFAULT_STORE_PATH):
+    """Read labels and descendants from an imported dump at path, path=None goes back to SPARQL."""
+    global _store, _store_configured
+    with _store_lock:
+        _store = WikidataStore(path) if path else None
+        _store_configured = True
+    return _store
+
+
+def get_store():
+    """The local store, opened from the environment on first use."""
+    global _store, _store_configured
+    if not _store_configured:
+        # checked again under the lock so racing threads open the store once
+        with _store_lock:
+            if not _store_configured:
+                _store = WikidataStore(DEFAULT_STORE_PATH) if DEFAULT_STORE_PATH else None
+                _store_configured = True
+    return _store
+
+
+class Descendant(NamedTuple):
+    qid: str  # entity code of the value, "" for literals
+    value: str
+    property: str
+
+
+class DescendantColumns:
+    """Children as three parallel lists of str instead of one object per row."""
+
+    __slots__ = ("qids", "values", "properties")
+
+    def __init__(self):
+        self.qids = []
+        self.values = []
+        self.properties = []
+
+    def __len__(self):
+        return len(self.qids)
+
+    def __getitem__(self, idx) -> Descendant:
+        return Descendant(self.qids[idx], self.values[idx], self.properties[idx])
+
+    def append(self, qid, value, property):
+        self.qids.append(qid)
+        self.values.append(value)
+        self.properties.append(property)
+
+    def replace(self, idx, qid, value, property):
+        self.qids[idx] = qid
+        self.values[idx] = value
+        self.properties[idx] = property
+
+
+class Descendants(NamedTuple):
+    entity_code: str
+    label: Optional[str]  # English label of entity_code, None without one
+    children: DescendantColumns
+
 
+def query_wd(query, use_cache=True):
+    cache = get_cache() if use_cache else None
+    if cache is not None:
+        result = cache.get(query)
+        if result is not None:
+            return result
+        if cache.offline:
+            raise OfflineCacheMiss(f"Query is not in the offline SPARQL cache {cache.path}:\n{query}")
 
-def query_wd(query):
     try:
-        sparql.setQuery(query)
-        sparql.setReturnFormat(JSON)
-        return sparql.query().convert()
-    except EndPointInternalError as e:
-        raise RuntimeError("SPARQL endpoint returned an internal error.") from e
+        result = client.query(query)
+    except SparqlError as e:
+        if e.status_code is not None and e.status_code >= 500:
+            raise RuntimeError("SPARQL endpoint returned an internal error.") from e
+        raise RuntimeError("Failed to query SPARQL endpoint.") from e
     except Exception as e:
         raise RuntimeError("Failed to query SPARQL endpoint.") from e
 
+    if cache is not None:
+        cache.put(query, result)
+    return result
+
 
 def verify_label(label):
     try:
@@ -92,6 +285,9 @@ def verify_entity_code(entity_code):
 
 
 def get_label(entity_code):
+    store = get_store()
+    if store is not None:
+        return store.label(entity_code)
     try:
         result = query_wd(entity_code_to_label_query.format(entity_code=entity_code))
         if result["results"]["bindings"] != []:
@@ -102,7 +298,66 @@ def get_label(entity_code):
         raise e
 
 
+def get_labels(entity_codes, chunk_size=LABEL_CHUNK_SIZE) -> dict:
+    """
+    Resolve many entity codes to their English label, chunk_size codes per
+    VALUES query. Codes without a label map to None.
+
+    Each label is cached as the response get_label would have received, so
+    get_label and later batches reuse it.
+    """
+    entity_codes = list(dict.fromkeys(entity_codes))
+    store = get_store()
+    if store is not None:
+        return {entity_code: store.label(entity_code) for entity_code in entity_codes}
+    cache = get_cache()
+    labels = {}
+    missing = []
+    for entity_code in entity_codes:
+        cached = cache.get(entity_code_to_label_query.format(entity_code=entity_code)) if cache else None
+        if cached is None:
+            missing.append(entity_code)
+        else:
+            bindings = cached["results"]["bindings"]
+            labels[entity_code] = bindings[0]["label"]["value"] if bindings else None
+    if missing and cache is not None and cache.offline:
+        raise OfflineCacheMiss(f"Labels of {missing[:5]} are not in the offline SPARQL cache {cache.path}")
+
+    for start in range(0, len(missing), chunk_size):
+        chunk = missing[start : start + chunk_size]
+        items = " ".join(f"wd:{entity_code}" for entity_code in chunk)
+        result = query_wd(entity_codes_to_labels_query.format(items=items), use_cache=False)
+        found = {}
+        for binding in result["results"]["bindings"]:
+            # like LIMIT 1 in get_label, the first English label wins
+            found.setdefault(binding["qid"]["value"], binding["label"])
+        for entity_code in chunk:
+            label = found.get(entity_code)
+            labels[entity_code] = label["value"] if label else None
+            _cache_label(entity_code, label)
+    return labels
+
+
+def _cache_label(entity_code, label):
+    """Store label (a SPARQL binding or None) as the response get_label would receive."""
+    cache = get_cache()
+    if cache is None:
+        return
+    response = {
+        "head": {"vars": ["label"]},
+        "results": {"bindings": [{"label": label}] if label else []},
+    }
+    cache.put(entity_code_to_label_query.format(entity_code=entity_code), response)
+
+
 def get_entity_code(label):
+    store = get_store()
+    if store is not None:
+        entity_code = store.entity_code(label)
+        if entity_code is None:
+            # same as an empty SPARQL result, see verify_label
+            raise IndexError(f"No entity labelled {label!r}")
+        return entity_code
     result = query_wd(label_to_entity_code_query.format(label=label))
     try:
         return result["results"]["bindings"][0]["qid"]["value"]
@@ -110,20 +365,233 @@ def get_entity_code(label):
         raise e
 
 
-def get_direct_descendents(identifier, by_label=False) -> dict:
+def get_direct_descendents(identifier, by_label=False, sample=None, rng=random) -> Descendants:
+    """
+    Children of an entity with their relation, and the entity's own label, in one query.
+
+    With sample=k only a uniform sample of k children is kept, drawn with
+    reservoir sampling while the response streams in, so memory stays
+    bounded on entities with thousands of claims. The response is never held
+    in full: the sample is cached instead, seeded by one of SAMPLE_SEEDS
+    seeds drawn from rng as in sample_direct_descendents, so repeated calls
+    (and offline mode) are served from the cache.
+    """
+    if by_label:
+        entity_code = get_entity_code(identifier)
+    else:
+        entity_code = identifier
+
+    store = get_store()
+    if store is not None:
+        return Descendants(
+            entity_code, store.label(entity_code), _sample_rows(store.descendants(entity_code), sample, rng)
+        )
+
+    query = direct_descendents_query.format(entity_code=entity_code)
+    if sample is None:
+        return _read_descendants(entity_code, query_wd(query)["results"]["bindings"])
+    seed = rng.randrange(SAMPLE_SEEDS)
+    seeded = random.Random(f"{entity_code}:{seed}")
+    bindings = _sampled_bindings(query, lambda bindings: _reservoir(bindings, sample, seeded), sample=sample, seed=seed)
+    return _read_descendants(entity_code, bindings)
+
+
+def _sample_key(query, **params):
+    """Cache key of a sample of the response of query, a comment never sent to the endpoint."""
+    return query + "".join(f"\n# {name}={value}" for name, value in params.items())
+
+
+def _sampled_bindings(query, draw, **params):
+    """
+    The bindings draw() keeps of the response of query, cached under the
+    query and params. draw must be deterministic for given params: a cached
+    full response is sampled from with it, otherwise the response is streamed
+    through it and only the sample is cached.
+    """
+    cache = get_cache()
+    if cache is None:
+        return draw(client.iter_bindings(query))
+    key = _sample_key(query, **params)
+    cached = cache.get(key)
+    if cached is not None:
+        return cached["results"]["bindings"]
+    cached = cache.get(query)
+    if cached is not None:
+        return draw(cached["results"]["bindings"])
+    if cache.offline:
+        raise OfflineCacheMiss(f"Query is not in the offline SPARQL cache {cache.path}:\n{key}")
+    bindings = draw(client.iter_bindings(query))
+    cache.put(key, {"results": {"bindings": bindings}})
+    return bindings
+
+
+def sample_direct_descendents(
+    identifier, k, by_label=False, seed=None, max_literal_length=MAX_LITERAL_LENGTH, rng=random
+) -> Descendants:
+    """
+    Up to k children sampled by the endpoint with sampled_descendents_query,
+    so only k rows are transferred. URLs, the item itself and literals longer
+    than max_literal_length are filtered out by the query as well.
+
+    Without a seed one of SAMPLE_SEEDS seeds is drawn from rng: every entity
+    then has a bounded number of distinct samples that the response cache
+    (and offline mode) can serve.
+    """
     if by_label:
         entity_code = get_entity_code(identifier)
     else:
         entity_code = identifier
+    if seed is None:
+        seed = rng.randrange(SAMPLE_SEEDS)
+
+    store = get_store()
+    if store is not None:
+        rows = _filter_rows(entity_code, store.descendants(entity_code), max_literal_length)
+        # a (entity, seed) pair always selects the same rows, as on the endpoint
+        rows = random.Random(f"{entity_code}:{seed}").sample(rows, min(int(k), len(rows)))
+        return Descendants(entity_code, store.label(entity_code), _sample_rows(rows))
 
-    result = query_wd(direct_descendents_query.format(entity_code=entity_code))
+    query = sampled_descendents_query.format(
+        entity_code=entity_code, seed=seed, limit=int(k), max_literal_length=int(max_literal_length)
+    )
+    return _read_descendants(entity_code, query_wd(query)["results"]["bindings"])
 
-    children = {}
-    columns = result["head"]["vars"]
-    for idx, binding in enumerate(result["results"]["bindings"]):
-        children[idx] = {
-            "qid": binding[columns[0]]["value"],
-            "value": binding[columns[1]]["value"],
-            "property": binding[columns[2]]["value"],
+
+def get_descendants_bulk(
+    entity_codes,
+    chunk_size=BULK_CHUNK_SIZE,
+    max_literal_length=MAX_LITERAL_LENGTH,
+    max_children=BULK_MAX_CHILDREN,
+    rng=random,
+    seed=None,
+) -> dict:
+    """
+    Descendants of many entities, chunk_size entities per query, filtered
+    like sample_direct_descendents. Used to prefetch a whole neighbourhood,
+    see ego_graph.EgoGraph.
+
+    Every entity keeps a uniform sample of at most max_children children
+    (None keeps all), drawn with one reservoir per entity while the response
+    streams in, so memory does not grow with the claims of hubs. The
+    reservoirs are seeded by the chunk and seed (one of SAMPLE_SEEDS drawn
+    from rng by default) and the capped rows of every chunk are cached under
+    its query, max_children and seed, so prefetching the same neighbourhood
+    again, or offline, does not stream anything.
+    """
+    entity_codes = list(dict.fromkeys(entity_codes))
+    store = get_store()
+    if store is not None:
+        return {
+            entity_code: Descendants(
+                entity_code,
+                store.label(entity_code),
+                _sample_rows(
+                    _filter_rows(entity_code, store.descendants(entity_code), max_literal_length), max_children, rng
+                ),
+            )
+            for entity_code in entity_codes
         }
+    if seed is None:
+        seed = rng.randrange(SAMPLE_SEEDS)
+
+    children = {entity_code: DescendantColumns() for entity_code in entity_codes}
+    labels = {}
+    for start in range(0, len(entity_codes), chunk_size):
+        chunk = entity_codes[start : start + chunk_size]
+        query = bulk_descendents_query.format(
+            items=" ".join(f"wd:{entity_code}" for entity_code in chunk),
+            max_literal_length=int(max_literal_length),
+        )
+        seeded = random.Random(f"{' '.join(chunk)}:{seed}")
+        bindings = _sampled_bindings(
+            query,
+            lambda bindings: _reservoir_per_item(bindings, max_children, seeded),
+            max_children=max_children,
+            seed=seed,
+        )
+        for binding in bindings:
+            entity_code = binding["itemQid"]["value"]
+            if entity_code not in children:
+                continue
+            if entity_code not in labels and "parentName" in binding:
+                labels[entity_code] = binding["parentName"]
+            children[entity_code].append(
+                binding["qid"]["value"], binding["valueLabel"]["value"], binding["propLabel"]["value"]
+            )
+    for entity_code, label in labels.items():
+        _cache_label(entity_code, label)
+    return {
+        entity_code: Descendants(
+            entity_code, labels[entity_code]["value"] if entity_code in labels else None, children[entity_code]
+        )
+        for entity_code in entity_codes
+    }
+
+
+def _reservoir_per_item(bindings, k=None, rng=random) -> list:
+    """A uniform sample of k bindings of every ?itemQid, see _reservoir."""
+    samples = {}
+    seen = {}
+    for binding in bindings:
+        entity_code = binding["itemQid"]["value"]
+        sample = samples.setdefault(entity_code, [])
+        count = seen.get(entity_code, 0)
+        seen[entity_code] = count + 1
+        if k is None or count < k:
+            sample.append(binding)
+        else:
+            idx = rng.randrange(count + 1)
+            if idx < k:
+                sample[idx] = binding
+    return [binding for sample in samples.values() for binding in sample]
+
+
+def _filter_rows(entity_code, rows, max_literal_length=MAX_LITERAL_LENGTH):
+    """The rows descendents_filter keeps, for backends that cannot run it."""
+    return [
+        (qid, value, prop)
+        for qid, value, prop in rows
+        if qid != entity_code and (qid or (len(value) <= max_literal_length and not URL_PATTERN.match(value)))
+    ]
+
+
+def _reservoir(items, k=None, rng=random) -> list:
+    """All items, or a uniform sample of k of them drawn in one pass."""
+    sample = []
+    for seen, item in enumerate(items):
+        if k is None or seen < k:
+            sample.append(item)
+        else:
+            idx = rng.randrange(seen + 1)
+            if idx < k:
+                sample[idx] = item
+    return sample
+
+
+def _sample_rows(rows, sample=None, rng=random) -> DescendantColumns:
+    """All (qid, value, property) rows, or a reservoir sample of sample of them."""
+    children = DescendantColumns()
+    for seen, row in enumerate(rows):
+        if sample is None or seen < sample:
+            children.append(*row)
+        else:
+            idx = rng.randrange(seen + 1)
+            if idx < sample:
+                children.replace(idx, *row)
     return children
+
+
+def _read_descendants(entity_code, bindings, sample=None, rng=random) -> Descendants:
+    label = None
+
+    def rows():
+        nonlocal label
+        for binding in bindings:
+            if label is None:
+                label = binding.get("parentName")
+            yield binding["qid"]["value"], binding["valueLabel"]["value"], binding["propLabel"]["value"]
+
+    children = _sample_rows(rows(), sample, rng)
+    if label is not None:
+        _cache_label(entity_code, label)
+    return Descendants(entity_code, label["value"] if label else None, children)
@@ -0,0 +1,118 @@
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS responses (
+    key TEXT PRIMARY KEY,
+    query TEXT NOT NULL,
+    response TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    created REAL NOT NULL,
+    accessed REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed);
+"""
+
+
+class OfflineCacheMiss(RuntimeError):
+    """Raised in offline mode for a query that has no cached response."""
+
+
+def normalize_query(query: str) -> str:
+    """Collapse whitespace so that re-indented copies of a query share an entry."""
+    return " ".join(query.split())
+
+
+def query_key(query: str) -> str:
+    return hashlib.sha1(normalize_query(query).encode("utf-8")).hexdigest()
+
+
+class SparqlCache:
+    """
+    Persistent SQLite cache of SPARQL JSON responses keyed by normalised query text.
+
+    Entries older than ttl seconds are refetched (ttl=None keeps them
+    forever) and the least recently used entries are evicted once the
+    responses take more than max_bytes. In offline mode, expired entries are
+    still served and a query without an entry raises OfflineCacheMiss
+    instead of reaching the endpoint. Safe to share between threads.
+    """
+
+    def __init__(self, path="sparql_cache.sqlite", ttl=30 * 24 * 3600, max_bytes=1 << 30, offline=False):
+        self.path = path
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.offline = offline
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.executescript(SCHEMA)
+        self._nbytes = self._connection.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
+
+    def __len__(self):
+        with self._lock:
+            return self._connection.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+
+    def __repr__(self):
+        return (
+            f"SparqlCache({self.path!r}, {self._nbytes / 2**20:.1f} MiB, "
+            f"hits={self.hits}, misses={self.misses}, offline={self.offline})"
+        )
+
+    def get(self, query: str):
+        """Return the cached response of query, or None when it is missing or expired."""
+        key = query_key(query)
+        now = time.time()
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT response, created FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None or (not self.offline and self.ttl is not None and now - row[1] > self.ttl):
+                self.misses += 1
+                return None
+            with self._connection:
+                self._connection.execute("UPDATE responses SET accessed = ? WHERE key = ?", (now, key))
+            self.hits += 1
+        return json.loads(row[0])
+
+    def put(self, query: str, response):
+        text = json.dumps(response, separators=(",", ":"))
+        size = len(text)
+        if size > self.max_bytes:
+            return
+        key = query_key(query)
+        now = time.time()
+        with self._lock, self._connection:
+            old = self._connection.execute("SELECT size FROM responses WHERE key = ?", (key,)).fetchone()
+            self._connection.execute(
+                "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?)",
+                (key, normalize_query(query), text, size, now, now),
+            )
+            self._nbytes += size - (old[0] if old else 0)
+            if self._nbytes > self.max_bytes:
+                self._evict()
+
+    def _evict(self):
+        # called with the lock held, frees down to 90% of the budget so puts
+        # right at the limit do not evict on every call
+        target = int(self.max_bytes * 0.9)
+        for key, size in self._connection.execute(
+            "SELECT key, size FROM responses ORDER BY accessed"
+        ).fetchall():
+            if self._nbytes <= target:
+                break
+            self._connection.execute("DELETE FROM responses WHERE key = ?", (key,))
+            self._nbytes -= size
+
+    def clear(self):
+        with self._lock, self._connection:
+            self._connection.execute("DELETE FROM responses")
+            self._nbytes = 0
@@ -0,0 +1,214 @@
+import codecs
+import json
+import random
+import re
+import threading
+import time
+import requests
+from requests.adapters import HTTPAdapter
+
+WIKIDATA_ENDPOINT = "https://query.wikidata.org/bigdata/namespace/wdq/sparql"
+USER_AGENT = "block-diagram-augmentations/1.0 (https://www.wikidata.org/wiki/Wikidata:Data_access) python-requests"
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+# GET keeps responses cacheable by the endpoint, longer queries have to be POSTed
+MAX_GET_QUERY_LENGTH = 2000
+STREAM_CHUNK_SIZE = 1 << 16
+_BINDINGS_START = re.compile(r'"bindings"\s*:\s*\[')
+_SEPARATORS = " \t\r\n,"
+
+
+class SparqlError(RuntimeError):
+    """The endpoint rejected a query or kept failing after all retries."""
+
+    def __init__(self, message, status_code=None):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+def iter_json_bindings(chunks):
+    """
+    Yield the objects of results.bindings of a SPARQL JSON body given as byte
+    chunks, decoding one binding at a time instead of the whole document.
+    """
+    decoder = json.JSONDecoder()
+    utf8 = codecs.getincrementaldecoder("utf-8")()
+    chunks = iter(chunks)
+    buffer = ""
+    pos = None
+    for chunk in chunks:
+        buffer += utf8.decode(chunk)
+        match = _BINDINGS_START.search(buffer)
+        if match:
+            pos = match.end()
+            break
+        # keep enough of the tail for a key split across chunks
+        buffer = buffer[-64:]
+    if pos is None:
+        raise SparqlError("SPARQL response has no results.bindings")
+
+    while True:
+        while pos < len(buffer) and buffer[pos] in _SEPARATORS:
+            pos += 1
+        if pos < len(buffer) and buffer[pos] == "]":
+            return
+        try:
+            binding, end = decoder.raw_decode(buffer, pos)
+        except json.JSONDecodeError:
+            # the binding continues in the next chunk
+            chunk = next(chunks, None)
+            if chunk is None:
+                raise SparqlError("SPARQL response ended inside results.bindings")
+            buffer = buffer[pos:] + utf8.decode(chunk)
+            pos = 0
+            continue
+        yield binding
+        pos = end
+
+
+class TokenBucket:
+    """Allows rate acquisitions per second on average with bursts of up to burst."""
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self._tokens = burst
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+    def pause(self, seconds):
+        """Take all tokens away for seconds, e.g. after a 429 with Retry-After."""
+        with self._lock:
+            self._tokens = min(self._tokens, 0) - seconds * self.rate
+
+
+class SparqlClient:
+    """
+    Thread-safe SPARQL JSON client for the Wikidata query service.
+
+    All threads share one keep-alive connection pool; every call keeps its
+    request state local, so no query can leak into another thread's request.
+    Requests are limited by a token bucket (rate per second, burst) and to
+    max_concurrent in flight, the number of parallel queries Wikidata allows
+    per client. 429 and 5xx responses and connection errors are retried
+    up to max_retries times with jittered exponential backoff, honouring
+    Retry-After; the bucket is paused on a 429 so other threads back off too.
+    """
+
+    def __init__(
+        self,
+        endpoint=WIKIDATA_ENDPOINT,
+        rate=5.0,
+        burst=10,
+        max_concurrent=5,
+        max_retries=5,
+        backoff=1.0,
+        max_backoff=60.0,
+        timeout=70.0,
+        user_agent=USER_AGENT,
+    ):
+        self.endpoint = endpoint
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.timeout = timeout
+        self.bucket = TokenBucket(rate, burst)
+        self._slots = threading.BoundedSemaphore(max_concurrent)
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max_concurrent)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.session.headers.update({"User-Agent": user_agent, "Accept": "application/sparql-results+json"})
+
+    def close(self):
+        self.session.close()
+
+    def _delay(self, attempt, response=None):
+        retry_after = response.headers.get("Retry-After") if response is not None else None
+        if retry_after is not None:
+            try:
+                return min(float(retry_after), self.max_backoff)
+            except ValueError:
+                pass
+        # full jitter, spreads retries of many threads that failed together
+        return random.uniform(0, min(self.max_backoff, self.backoff * 2**attempt))
+
+    def _send(self, query, stream=False):
+        # with stream=True only the headers are read here, the body is read by the caller
+        if len(query) <= MAX_GET_QUERY_LENGTH:
+            return self.session.get(
+                self.endpoint, params={"query": query, "format": "json"}, timeout=self.timeout, stream=stream
+            )
+        return self.session.post(
+            self.endpoint, data={"query": query, "format": "json"}, timeout=self.timeout, stream=stream
+        )
+
+    def _request(self, query, stream=False):
+        """
+        The 200 response of query. With stream=True the body is still unread
+        and the response keeps its slot of max_concurrent until _release().
+        """
+        for attempt in range(self.max_retries + 1):
+            self.bucket.acquire()
+            response = None
+            self._slots.acquire()
+            try:
+                response = self._send(query, stream)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                self._slots.release()
+                if attempt == self.max_retries:
+                    raise SparqlError(f"SPARQL endpoint unreachable: {e}") from e
+            except BaseException:
+                self._slots.release()
+                raise
+            else:
+                if response.status_code == 200:
+                    if not stream:
+                        self._slots.release()
+                    return response
+                # error bodies are short, read one for the message and give the
+                # connection back before waiting
+                message = response.text[:500]
+                response.close()
+                self._slots.release()
+                if response.status_code not in RETRY_STATUS_CODES or attempt == self.max_retries:
+                    raise SparqlError(
+                        f"SPARQL endpoint returned {response.status_code}: {message}", response.status_code
+                    )
+            delay = self._delay(attempt, response)
+            if response is not None and response.status_code == 429:
+                # the next acquire() waits, for this thread and all others
+                self.bucket.pause(delay)
+            else:
+                time.sleep(delay)
+
+    def query(self, query):
+        """Run query and return the decoded SPARQL JSON results."""
+        return self._request(query).json()
+
+    def _release(self, response):
+        response.close()
+        self._slots.release()
+
+    def iter_bindings(self, query):
+        """
+        Run query and yield its bindings while the body is still arriving.
+        The query counts against max_concurrent until the generator finishes;
+        closing it early drops the rest of the response unread.
+        """
+        response = self._request(query, stream=True)
+        try:
+            yield from iter_json_bindings(response.iter_content(STREAM_CHUNK_SIZE))
+        finally:
+            self._release(response)
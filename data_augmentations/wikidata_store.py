@@ -0,0 +1,455 @@
+"""
+Local, memory-mapped copy of the parts of Wikidata the graph generators use.
+
+import_dump() streams a Wikidata JSON dump (latest-all.json[.gz|.bz2], one
+entity per line) or an N-Triples dump of truthy statements into a directory
+of .npy arrays:
+
+    entity_ids, entity_flags       QID number and flags of every row, in dump order
+    label_offsets, label_buffer    English label of every row (packed UTF-8)
+    edge_offsets                   CSR row pointer, edges of row i are edge_offsets[i]:edge_offsets[i + 1]
+    edge_properties, edge_objects  property number and object of every edge; objects >= 0
+                                   are QID numbers, -1 - j is literal j
+    literal_offsets, literal_buffer
+    sorted_ids, sorted_rows        entity_ids sorted, for binary search lookups
+    label_hashes, label_rows       hashed labels sorted, for label -> QID lookups
+    property_ids, property_flags, property_label_offsets, property_label_buffer
+
+WikidataStore answers the same questions as the SPARQL queries in lib.py
+(labels, entity codes, direct descendants with the same property and
+Wikimedia-item filters) without the network.
+"""
+import bz2
+import gzip
+import hashlib
+import json
+import os
+import re
+import shutil
+from array import array
+import numpy as np
+
+# same exclusions as lib.direct_descendents_query
+EXCLUDED_PROPERTIES = {1424, 1482, 1855, 5008, 6104, 1963, 2559, 373, 1472, 1612, 3722, 910, 301, 5125}
+WIKIMEDIA_CLASSES = {4167836, 26884324, 4167410}
+INSTANCE_OF = 31
+
+# entity_flags
+FLAG_WIKIMEDIA = 1
+# property_flags
+FLAG_EXTERNAL_ID = 1
+
+COMMONS_FILE_PATH = "http://commons.wikimedia.org/wiki/Special:FilePath/"
+ENTITY_PREFIX = "http://www.wikidata.org/entity/"
+DIRECT_PREFIX = "http://www.wikidata.org/prop/direct/"
+RDFS_LABEL = "http://www.w3.org/2000/01/rdf-schema#label"
+PROPERTY_TYPE = "http://wikiba.se/ontology#propertyType"
+EXTERNAL_ID_TYPE = "http://wikiba.se/ontology#ExternalId"
+
+ARRAYS = (
+    "entity_ids",
+    "entity_flags",
+    "label_offsets",
+    "label_buffer",
+    "edge_offsets",
+    "edge_properties",
+    "edge_objects",
+    "literal_offsets",
+    "literal_buffer",
+    "sorted_ids",
+    "sorted_rows",
+    "label_hashes",
+    "label_rows",
+    "property_ids",
+    "property_flags",
+    "property_label_offsets",
+    "property_label_buffer",
+)
+
+
+def label_hash(label):
+    return int.from_bytes(hashlib.blake2b(label.encode("utf-8"), digest_size=8).digest(), "little") >> 1
+
+
+def _open_dump(path):
+    if path.endswith(".gz"):
+        return gzip.open(path, "rt", encoding="utf-8")
+    if path.endswith(".bz2"):
+        return bz2.open(path, "rt", encoding="utf-8")
+    return open(path, encoding="utf-8")
+
+
+def _save_raw(raw_path, path, dtype, length):
+    """Turn a file of raw little-endian values into an .npy without loading it."""
+    with open(path, "wb") as out:
+        np.lib.format.write_array_header_1_0(
+            out, {"descr": np.dtype(dtype).str, "fortran_order": False, "shape": (length,)}
+        )
+        with open(raw_path, "rb") as raw:
+            shutil.copyfileobj(raw, out, 1 << 24)
+    os.remove(raw_path)
+
+
+class _Column:
+    """Append-only numeric column spooled to disk, so imports do not grow in memory."""
+
+    def __init__(self, directory, name, typecode, dtype):
+        self.directory = directory
+        self.name = name
+        self.dtype = dtype
+        self.typecode = typecode
+        self.raw_path = os.path.join(directory, f"{name}.tmp")
+        self.file = open(self.raw_path, "wb")
+        self.pending = array(typecode)
+        self.length = 0
+
+    def append(self, value):
+        self.pending.append(value)
+        self.length += 1
+        if len(self.pending) >= 1 << 16:
+            self.flush()
+
+    def flush(self):
+        self.pending.tofile(self.file)
+        self.pending = array(self.typecode)
+
+    def save(self):
+        self.flush()
+        self.file.close()
+        _save_raw(self.raw_path, os.path.join(self.directory, f"{self.name}.npy"), self.dtype, self.length)
+
+
+class _StringColumn:
+    """Packed UTF-8 strings: <prefix>_buffer.npy bytes and <prefix>_offsets.npy."""
+
+    def __init__(self, directory, prefix):
+        self.offsets = _Column(directory, f"{prefix}_offsets", "q", np.int64)
+        self.offsets.append(0)
+        self.end = 0
+        self.directory = directory
+        self.prefix = prefix
+        self.raw_path = os.path.join(directory, f"{prefix}_buffer.tmp")
+        self.buffer = open(self.raw_path, "wb")
+
+    def __len__(self):
+        return self.offsets.length - 1
+
+    def append(self, string):
+        data = string.encode("utf-8")
+        self.buffer.write(data)
+        self.end += len(data)
+        self.offsets.append(self.end)
+        return len(self) - 1
+
+    def save(self):
+        self.buffer.close()
+        _save_raw(self.raw_path, os.path.join(self.directory, f"{self.prefix}_buffer.npy"), np.uint8, self.end)
+        self.offsets.save()
+
+
+class _Importer:
+    def __init__(self, directory):
+        self.directory = directory
+        self.entity_ids = _Column(directory, "entity_ids", "q", np.int64)
+        self.entity_flags = _Column(directory, "entity_flags", "B", np.uint8)
+        self.labels = _StringColumn(directory, "label")
+        self.label_hashes = _Column(directory, "unsorted_label_hashes", "q", np.int64)
+        self.edge_offsets = _Column(directory, "edge_offsets", "q", np.int64)
+        self.edge_offsets.append(0)
+        self.edge_properties = _Column(directory, "edge_properties", "i", np.int32)
+        self.edge_objects = _Column(directory, "edge_objects", "q", np.int64)
+        self.literals = _StringColumn(directory, "literal")
+        self.properties = {}
+
+    def add_entity(self, qid, label, edges):
+        """edges are (property number, QID number or literal str) pairs."""
+        flags = 0
+        for prop, obj in edges:
+            if prop == INSTANCE_OF and obj in WIKIMEDIA_CLASSES:
+                flags |= FLAG_WIKIMEDIA
+            self.edge_properties.append(prop)
+            self.edge_objects.append(obj if isinstance(obj, int) else -1 - self.literals.append(obj))
+        self.entity_ids.append(qid)
+        self.entity_flags.append(flags)
+        self.labels.append(label or "")
+        self.label_hashes.append(label_hash(label or ""))
+        self.edge_offsets.append(self.edge_properties.length)
+
+    def add_property(self, pid, label, external_id):
+        self.properties[pid] = (label or "", FLAG_EXTERNAL_ID if external_id else 0)
+
+    def save(self):
+        d = self.directory
+        for column in (
+            self.entity_ids,
+            self.entity_flags,
+            self.labels,
+            self.label_hashes,
+            self.edge_offsets,
+            self.edge_properties,
+            self.edge_objects,
+            self.literals,
+        ):
+            column.save()
+
+        entity_ids = np.load(os.path.join(d, "entity_ids.npy"), mmap_mode="r")
+        sorted_rows = np.argsort(entity_ids, kind="stable")
+        np.save(os.path.join(d, "sorted_ids.npy"), entity_ids[sorted_rows])
+        np.save(os.path.join(d, "sorted_rows.npy"), sorted_rows)
+
+        hashes_path = os.path.join(d, "unsorted_label_hashes.npy")
+        hashes = np.load(hashes_path)
+        label_rows = np.argsort(hashes, kind="stable")
+        np.save(os.path.join(d, "label_hashes.npy"), hashes[label_rows])
+        np.save(os.path.join(d, "label_rows.npy"), label_rows)
+        del hashes
+        os.remove(hashes_path)
+
+        pids = sorted(self.properties)
+        names = _StringColumn(d, "property_label")
+        for pid in pids:
+            names.append(self.properties[pid][0])
+        names.save()
+        np.save(os.path.join(d, "property_ids.npy"), np.array(pids, dtype=np.int64))
+        np.save(
+            os.path.join(d, "property_flags.npy"), np.array([self.properties[p][1] for p in pids], dtype=np.uint8)
+        )
+
+
+def _datavalue_to_object(datavalue):
+    """QID number for items, display string for everything else, None to skip."""
+    kind = datavalue.get("type")
+    value = datavalue.get("value")
+    if kind == "wikibase-entityid":
+        if value.get("entity-type") == "item":
+            return int(value["numeric-id"])
+        return value.get("id")
+    if kind == "string":
+        return value
+    if kind == "monolingualtext":
+        return value["text"]
+    if kind == "quantity":
+        return value["amount"].lstrip("+")
+    if kind == "time":
+        return value["time"].lstrip("+")
+    if kind == "globecoordinate":
+        return f"Point({value['longitude']} {value['latitude']})"
+    return None
+
+
+def _truthy_edges(claims):
+    """(property, object) pairs of the statements WDQS exposes as wdt: triples."""
+    edges = []
+    for pid, statements in claims.items():
+        best = [s for s in statements if s.get("rank") == "preferred"]
+        if not best:
+            best = [s for s in statements if s.get("rank", "normal") == "normal"]
+        for statement in best:
+            snak = statement.get("mainsnak", {})
+            if snak.get("snaktype") != "value":
+                continue
+            obj = _datavalue_to_object(snak["datavalue"])
+            if obj is None:
+                continue
+            if snak.get("datatype") == "commonsMedia":
+                obj = COMMONS_FILE_PATH + obj.replace(" ", "%20")
+            edges.append((int(pid[1:]), obj))
+    return edges
+
+
+def _import_json(dump, importer, limit):
+    count = 0
+    for line in dump:
+        line = line.strip().rstrip(",")
+        if not line or line in ("[", "]"):
+            continue
+        entity = json.loads(line)
+        label = entity.get("labels", {}).get("en", {}).get("value")
+        if entity.get("type") == "property":
+            importer.add_property(int(entity["id"][1:]), label, entity.get("datatype") == "external-id")
+            continue
+        if entity.get("type") != "item":
+            continue
+        importer.add_entity(int(entity["id"][1:]), label, _truthy_edges(entity.get("claims", {})))
+        count += 1
+        if limit and count >= limit:
+            break
+
+
+_TRIPLE = re.compile(r'^<([^>]*)>\s+<([^>]*)>\s+(<[^>]*>|"(?:[^"\\]|\\.)*"(?:@[\w-]+|\^\^<[^>]*>)?)\s*\.\s*$')
+_LONG_ESCAPE = re.compile(r"\\U([0-9A-Fa-f]{8})")
+
+
+def _unescape_literal(term):
+    text = term[1 : term.rindex('"')]
+    text = _LONG_ESCAPE.sub(lambda m: chr(int(m.group(1), 16)), text)
+    return json.loads(f'"{text}"')
+
+
+def _import_ntriples(dump, importer, limit):
+    """Expects the triples of a subject to be contiguous, as in Wikidata's dumps."""
+    subject = None
+    label = None
+    edges = []
+    count = 0
+
+    def flush():
+        nonlocal count
+        if subject is not None and subject.startswith("Q"):
+            importer.add_entity(int(subject[1:]), label, edges)
+            count += 1
+
+    for line in dump:
+        match = _TRIPLE.match(line)
+        if match is None or not match.group(1).startswith(ENTITY_PREFIX):
+            continue
+        s, p, o = match.groups()
+        s = s[len(ENTITY_PREFIX) :]
+        if s != subject:
+            flush()
+            if limit and count >= limit:
+                return
+            subject, label, edges = s, None, []
+        if p == RDFS_LABEL:
+            if o.endswith('"@en'):
+                label = _unescape_literal(o)
+                if s.startswith("P"):
+                    _, flags = importer.properties.get(int(s[1:]), ("", 0))
+                    importer.add_property(int(s[1:]), label, flags & FLAG_EXTERNAL_ID)
+        elif p == PROPERTY_TYPE and s.startswith("P"):
+            name, _ = importer.properties.get(int(s[1:]), ("", 0))
+            importer.add_property(int(s[1:]), name, o == f"<{EXTERNAL_ID_TYPE}>")
+        elif p.startswith(DIRECT_PREFIX):
+            prop = int(p[len(DIRECT_PREFIX) + 1 :])
+            if o.startswith(f"<{ENTITY_PREFIX}Q"):
+                edges.append((prop, int(o[len(ENTITY_PREFIX) + 2 : -1])))
+            elif o.startswith("<"):
+                edges.append((prop, o[1:-1]))
+            else:
+                edges.append((prop, _unescape_literal(o)))
+    flush()
+
+
+def import_dump(dump_path, store_dir, limit=None):
+    """
+    Import a Wikidata JSON (.json) or N-Triples (.nt) dump, optionally gzip or
+    bz2 compressed, into store_dir. limit stops after that many items, e.g.
+    for a quick test subset. Returns the opened WikidataStore.
+    """
+    os.makedirs(store_dir, exist_ok=True)
+    importer = _Importer(store_dir)
+    base = re.sub(r"\.(gz|bz2)$", "", dump_path)
+    with _open_dump(dump_path) as dump:
+        if base.endswith(".nt"):
+            _import_ntriples(dump, importer, limit)
+        else:
+            _import_json(dump, importer, limit)
+    importer.save()
+    return WikidataStore(store_dir)
+
+
+class WikidataStore:
+    """Read-only view of an imported dump, every array is memory-mapped."""
+
+    def __init__(self, store_dir):
+        self.store_dir = store_dir
+        for name in ARRAYS:
+            setattr(self, name, np.load(os.path.join(store_dir, f"{name}.npy"), mmap_mode="r"))
+
+    def __len__(self):
+        return len(self.entity_ids)
+
+    def __repr__(self):
+        return f"WikidataStore({self.store_dir!r}, {len(self)} entities, {len(self.edge_objects)} edges)"
+
+    @staticmethod
+    def _string(buffer, offsets, idx):
+        return bytes(buffer[offsets[idx] : offsets[idx + 1]]).decode("utf-8")
+
+    def row(self, entity_code):
+        """Row of an entity code like "Q42", None when it is not in the store."""
+        if not entity_code or entity_code[0] != "Q" or not entity_code[1:].isdigit():
+            return None
+        qid = int(entity_code[1:])
+        i = np.searchsorted(self.sorted_ids, qid)
+        if i < len(self.sorted_ids) and self.sorted_ids[i] == qid:
+            return int(self.sorted_rows[i])
+        return None
+
+    def _row_label(self, row):
+        return self._string(self.label_buffer, self.label_offsets, row) or None
+
+    def label(self, entity_code):
+        """English label of entity_code, None when unknown or unlabelled."""
+        row = self.row(entity_code)
+        return None if row is None else self._row_label(row)
+
+    def entity_code(self, label):
+        """QID of the first entity with this English label, None without one."""
+        key = label_hash(label)
+        i = np.searchsorted(self.label_hashes, key)
+        while i < len(self.label_hashes) and self.label_hashes[i] == key:
+            row = int(self.label_rows[i])
+            if self._row_label(row) == label:
+                return f"Q{self.entity_ids[row]}"
+            i += 1
+        return None
+
+    def property_label(self, pid):
+        i = np.searchsorted(self.property_ids, pid)
+        if i < len(self.property_ids) and self.property_ids[i] == pid:
+            return self._string(self.property_label_buffer, self.property_label_offsets, i) or f"P{pid}"
+        return f"P{pid}"
+
+    def _excluded_properties(self):
+        excluded = getattr(self, "_excluded", None)
+        if excluded is None:
+            external = self.property_ids[(np.asarray(self.property_flags) & FLAG_EXTERNAL_ID) != 0]
+            excluded = self._excluded = EXCLUDED_PROPERTIES | set(int(pid) for pid in external)
+        return excluded
+
+    def descendants(self, entity_code):
+        """
+        (qid, value, property) rows like direct_descendents_query returns:
+        qid is "" for literals and values are labels, falling back to the
+        QID like the label service does.
+        """
+        row = self.row(entity_code)
+        if row is None or self.entity_flags[row] & FLAG_WIKIMEDIA:
+            return []
+        excluded = self._excluded_properties()
+        start, end = self.edge_offsets[row], self.edge_offsets[row + 1]
+        rows = []
+        for prop, obj in zip(self.edge_properties[start:end].tolist(), self.edge_objects[start:end].tolist()):
+            if prop in excluded:
+                continue
+            if obj >= 0:
+                qid = f"Q{obj}"
+                value = self.label(qid) or qid
+            else:
+                qid = ""
+                value = self._string(self.literal_buffer, self.literal_offsets, -1 - obj)
+            rows.append((qid, value, self.property_label(prop)))
+        return rows
+
+    def instances(self, class_code):
+        """QID numbers of all entities with a wdt:P31 claim on class_code, sorted."""
+        if not class_code or class_code[0] != "Q" or not class_code[1:].isdigit():
+            return np.empty(0, dtype=np.int64)
+        edges = np.flatnonzero(
+            (np.asarray(self.edge_properties) == INSTANCE_OF) & (np.asarray(self.edge_objects) == int(class_code[1:]))
+        )
+        rows = np.searchsorted(self.edge_offsets, edges, side="right") - 1
+        return np.unique(np.asarray(self.entity_ids)[rows])
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Import a Wikidata dump into a local graph store")
+    parser.add_argument("dump", type=str, help="latest-all.json.gz, latest-truthy.nt.bz2 or a filtered subset")
+    parser.add_argument("store_dir", type=str)
+    parser.add_argument("--limit", default=None, type=int, help="stop after this many items")
+    args = parser.parse_args()
+
+    print(import_dump(args.dump, args.store_dir, args.limit))
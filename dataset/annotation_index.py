@@ -0,0 +1,137 @@
+import os
+import numpy as np
+
+from voc import parse_voc_xml, select_parser
+
+
+def default_index_path(annotation_dir):
+    """The index lives next to the annotation directory, e.g. xml_files/train.index.npz."""
+    return os.path.normpath(annotation_dir) + ".index.npz"
+
+
+def stat_files(directory, filenames):
+    """Return (mtime_ns, size) int64 arrays used to invalidate cached tables."""
+    mtimes = np.empty(len(filenames), dtype=np.int64)
+    sizes = np.empty(len(filenames), dtype=np.int64)
+    for i, filename in enumerate(filenames):
+        st = os.stat(os.path.join(directory, filename))
+        mtimes[i] = st.st_mtime_ns
+        sizes[i] = st.st_size
+    return mtimes, sizes
+
+
+def save_arrays(path, **arrays):
+    """Write an .npz atomically so concurrent readers never see a partial file."""
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as f:
+        np.savez(f, **arrays)
+    os.replace(tmp_path, path)
+
+
+class AnnotationIndex:
+    """
+    Columnar view of every VOC annotation in a directory.
+
+    Objects of all images are concatenated; the objects of image i are
+    boxes[offsets[i]:offsets[i + 1]]. Labels are int16 codes into label_names.
+    """
+
+    def __init__(self, filenames, image_names, label_names, boxes, labels, offsets, widths, heights, mtimes, sizes):
+        self.filenames = filenames
+        self.image_names = image_names
+        self.label_names = label_names
+        self.boxes = boxes
+        self.labels = labels
+        self.offsets = offsets
+        self.widths = widths
+        self.heights = heights
+        self.mtimes = mtimes
+        self.sizes = sizes
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    @classmethod
+    def build(cls, annotation_dir, annotation_filenames, stats=None):
+        image_names = []
+        label_names = {}
+        boxes = []
+        labels = []
+        offsets = np.zeros(len(annotation_filenames) + 1, dtype=np.int64)
+        widths = np.zeros(len(annotation_filenames), dtype=np.int32)
+        heights = np.zeros(len(annotation_filenames), dtype=np.int32)
+
+        paths = [os.path.join(annotation_dir, filename) for filename in annotation_filenames]
+        parser = select_parser(paths)
+        for i, path in enumerate(paths):
+            image_name, width, height, names, image_boxes = parse_voc_xml(path, parser)
+            image_names.append(image_name or "")
+            widths[i] = width
+            heights[i] = height
+            boxes.extend(image_boxes)
+            labels.extend(label_names.setdefault(name, len(label_names)) for name in names)
+            offsets[i + 1] = offsets[i] + len(names)
+
+        mtimes, sizes = stats if stats is not None else stat_files(annotation_dir, annotation_filenames)
+        return cls(
+            filenames=np.array(list(annotation_filenames), dtype=str),
+            image_names=np.array(image_names, dtype=str),
+            label_names=np.array(list(label_names), dtype=str),
+            boxes=np.array(boxes, dtype=np.float32).reshape(-1, 4),
+            labels=np.array(labels, dtype=np.int16),
+            offsets=offsets,
+            widths=widths,
+            heights=heights,
+            mtimes=mtimes,
+            sizes=sizes,
+        )
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path, allow_pickle=False) as data:
+            return cls(**{key: data[key] for key in data.files})
+
+    def save(self, path):
+        save_arrays(path, **vars(self))
+
+    def is_valid_for(self, annotation_dir, annotation_filenames, stats=None):
+        if len(annotation_filenames) != len(self) or list(self.filenames) != list(annotation_filenames):
+            return False
+        mtimes, sizes = stats if stats is not None else stat_files(annotation_dir, annotation_filenames)
+        return np.array_equal(mtimes, self.mtimes) and np.array_equal(sizes, self.sizes)
+
+    @classmethod
+    def load_or_build(cls, annotation_dir, annotation_filenames, index_path=None, stats=None):
+        """
+        Load the persisted index if it still matches the XML files on disk
+        (same names, mtimes and sizes), otherwise parse everything once and
+        save the result. A read-only dataset directory only skips the save.
+        stats are the (mtimes, sizes) of the files when the caller already
+        has them, e.g. from the manifest, otherwise every file is stat'ed.
+        """
+        index_path = index_path or default_index_path(annotation_dir)
+        if os.path.exists(index_path):
+            try:
+                index = cls.load(index_path)
+                if index.is_valid_for(annotation_dir, annotation_filenames, stats):
+                    return index
+            except (OSError, ValueError, KeyError, TypeError):
+                pass
+
+        index = cls.build(annotation_dir, annotation_filenames, stats)
+        try:
+            index.save(index_path)
+        except OSError as e:
+            print(f"Could not save annotation index to {index_path}: {e}")
+        return index
+
+    def label_lookup(self, label_map=None):
+        """int64 table mapping label codes to label_map ids (1-based codes without a map)."""
+        if label_map is None:
+            return np.arange(1, len(self.label_names) + 1, dtype=np.int64)
+        return np.array([label_map[name] for name in self.label_names], dtype=np.int64)
+
+    def annotation(self, idx):
+        """Return (boxes, labels, width, height) for one image as views into the index."""
+        start, end = self.offsets[idx], self.offsets[idx + 1]
+        return self.boxes[start:end], self.labels[start:end], int(self.widths[idx]), int(self.heights[idx])
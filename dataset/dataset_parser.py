@@ -1,42 +1,103 @@
 import os
 import torch
+from concurrent.futures import ThreadPoolExecutor
 from PIL import Image
 from torch.utils.data import Dataset
-import xml.etree.ElementTree as ET
 import numpy as np
 
+from annotation_index import AnnotationIndex
+from image_sizes import read_image_size
+from manifest import load_pairs
+from pixel_cache import PixelCache, closest_level, expand_to_rgb, pyramid_levels
+from string_table import StringTable
+from targets import build_target, build_targets
+from transform_cache import file_key, transform_signature
+from voc import parse_voc_xml
+
 # add label map and convert labels to integers
 
 class XMLDataset(Dataset):
-    def __init__(self, image_dir, annotation_dir, label_map=None, transform=None):
+    def __init__(self, image_dir, annotation_dir, label_map=None, transform=None, index_path=None,
+                 cache_pixels=False, pixel_cache_path=None, max_size=None, pixel_mode="RGB", threshold=128,
+                 decode_threads=None, manifest_path=None, full_rescan=False, transform_cache=None,
+                 stat_files=True):
         self.image_dir = image_dir
         self.annotation_dir = annotation_dir
-        self.image_filenames = sorted(os.listdir(image_dir))
-        self.annotation_filenames = sorted(os.listdir(annotation_dir))
+        # images and annotations are paired by stem through a persistent manifest,
+        # unmatched files are reported and skipped. stat_files=False trusts the
+        # directory mtimes and skips the per-file stats, edits in place then
+        # need full_rescan=True
+        pairs = load_pairs(image_dir, annotation_dir, manifest_path, full_rescan, stat_files)
+        # packed string tables instead of lists keep worker memory flat (copy-on-write)
+        self.image_filenames = StringTable(pairs.image_filenames)
+        self.annotation_filenames = StringTable(pairs.annotation_filenames)
+        # image sizes read from the PNG headers by the manifest, 0 for other formats
+        self.image_widths = pairs.widths
+        self.image_heights = pairs.heights
+        # (size, mtime_ns) of the images, the image part of TransformCache keys
+        self.image_sizes = pairs.image_sizes
+        self.image_mtimes = pairs.image_mtimes
         self.label_map = label_map
         self.image_name = ""
         self.transform = transform
+        # "L" and "1" keep diagrams as 1-channel images, see pixel_cache.expand_to_rgb
+        self.pixel_mode = pixel_mode
+        self.threshold = threshold
+        # all XML files are parsed once into flat arrays, __getitem__ only slices them
+        self.index = AnnotationIndex.load_or_build(
+            annotation_dir, self.annotation_filenames, index_path, stats=pairs.annotation_stats
+        )
+        self.label_lookup = self.index.label_lookup(label_map)
+        # opt-in: decode every image once into a shared memory-mapped file,
+        # images are then returned as 3-channel float tensors in [0, 1], what
+        # ToTensor() makes of the PIL images, instead of PIL images. With max_size
+        # the one cache built is the pre-resized pyramid level closest to the
+        # detector's max_size (exactly max_size at a custom pixel_cache_path),
+        # boxes are rescaled to the level in __getitem__
+        self.pixel_cache = None
+        if cache_pixels or max_size is not None:
+            level = max_size
+            if max_size is not None and pixel_cache_path is None:
+                level = closest_level(pyramid_levels(image_dir, pixel_mode), max_size) or max_size
+            self.pixel_cache = PixelCache.load_or_build(
+                image_dir,
+                self.image_filenames,
+                pixel_cache_path,
+                max_size=level,
+                mode=pixel_mode,
+                threshold=threshold,
+                stats=pairs.image_stats,
+            )
+        # opt-in TransformCache for deterministic transforms (val/test), keyed by
+        # the image file's manifest stats and a signature of everything that
+        # shapes the output, so workers keep no per-sample state
+        self.transform_cache = transform_cache
+        self._transform_signature = transform_signature(
+            transform,
+            pixel_mode,
+            threshold,
+            None if self.pixel_cache is None else (self.pixel_cache.data_path, self.pixel_cache.max_size),
+        )
+        # __getitems__ decodes a batch concurrently, PIL and zlib release the GIL
+        self.decode_threads = decode_threads or min(8, os.cpu_count() or 1)
+        self._decode_pool = None
+        self._decode_pool_pid = None
+
+    def __getstate__(self):
+        # thread pools cannot be pickled or shared with forked workers
+        state = self.__dict__.copy()
+        state["_decode_pool"] = None
+        state["_decode_pool_pid"] = None
+        return state
         
     def parse_xml(self, annotation_path):
-        tree = ET.parse(annotation_path)
-        root = tree.getroot()
-        self.image_name = root.find('filename').text
-        
+        self.image_name, width, height, names, image_boxes = parse_voc_xml(annotation_path)
+
         boxes = []
         labels = []
         areas = []
-        size = root.find('size')
-        width = int(size.find('width').text)
-        height = int(size.find('height').text)
-        
-        
-        for obj in root.findall('object'):
-            label = obj.find('name').text
-            bndbox = obj.find('bndbox')
-            xmin = int(bndbox.find('xmin').text)
-            ymin = int(bndbox.find('ymin').text)
-            xmax = int(bndbox.find('xmax').text)
-            ymax = int(bndbox.find('ymax').text)
+        for label, (xmin, ymin, xmax, ymax) in zip(names, image_boxes):
+            xmin, ymin, xmax, ymax = int(xmin), int(ymin), int(xmax), int(ymax)
             xwidth = xmax - xmin
             yheight = ymax - ymin
             area = xwidth*yheight
@@ -50,42 +111,78 @@ class XMLDataset(Dataset):
         
         return torch.tensor(boxes, dtype=torch.float32), labels, areas, width, height
     
+    def load_image(self, img_path):
+        if self.pixel_mode == "RGB":
+            return Image.open(img_path).convert("RGB")
+        image = Image.open(img_path).convert("L")
+        if self.pixel_mode == "1":
+            image = image.point(lambda value: 255 if value >= self.threshold else 0)
+        return image
+
+    def get_image_info(self, idx):
+        # size of the image __getitem__ returns, transforms are assumed not to move boxes
+        height, width = self.get_height_and_width(idx)
+        return {'id': idx, 'height': height, 'width': width}
+
+    def get_annotations(self, idx):
+        # the target of __getitem__ without reading or decoding the image
+        return self._batch_targets([idx])[0]
+
+    def get_transformed_image(self, idx, image=None):
+        # image is get_image(idx) when the caller already decoded it
+        if not self.transform or self.transform_cache is None:
+            image = self.get_image(idx) if image is None else image
+            return self.transform(image) if self.transform else image
+
+        path = os.path.join(self.image_dir, self.image_filenames[idx])
+        key = f"{file_key(path, self.image_sizes[idx], self.image_mtimes[idx])}-{self._transform_signature}"
+        cached = self.transform_cache.get(key)
+        if cached is None:
+            cached = self.transform(self.get_image(idx) if image is None else image)
+            self.transform_cache.put(key, cached)
+        return cached
+
+    def get_image(self, idx):
+        if self.pixel_cache is not None:
+            # the model needs float input and ToTensor() passes tensors through
+            return expand_to_rgb([self.pixel_cache.image(idx)])[0]
+        image = self.load_image(os.path.join(self.image_dir, self.image_filenames[idx]))
+        if self.pixel_mode != "RGB":
+            # same 3-channel float image as from the pixel cache, so the output
+            # does not depend on whether caching is on
+            return expand_to_rgb([torch.from_numpy(np.array(image)).unsqueeze(0)])[0]
+        return image
+
     def __len__(self):
         return len(self.image_filenames)
+
+    def get_height_and_width(self, idx):
+        # used by group_by_aspect_ratio so that grouping never decodes an image
+        if self.pixel_cache is not None:
+            height, width, _ = self.pixel_cache.shapes[idx]
+            return int(height), int(width)
+        if self.image_widths[idx] <= 0 or self.image_heights[idx] <= 0:
+            self.image_widths[idx], self.image_heights[idx] = read_image_size(
+                os.path.join(self.image_dir, self.image_filenames[idx]), self.index.widths[idx], self.index.heights[idx]
+            )
+        return int(self.image_heights[idx]), int(self.image_widths[idx])
     
     def __getitem__(self, idx):
         
         try:
-            # Load image
-            img_path = os.path.join(self.image_dir, self.image_filenames[idx])
-            image = Image.open(img_path).convert("RGB")
+            # Load image, transformed if a transform is given
+            image = self.get_transformed_image(idx)
             
             # Load annotation
-            annotation_path = os.path.join(self.annotation_dir, self.annotation_filenames[idx])
-            boxes, labels, areas, width, height= self.parse_xml(annotation_path)
-            
-            target = {
-                'boxes': boxes,
-                'labels': labels,
-                'image_id': idx,
-                'area': areas,
-                }
-            
-             # Apply transformation if provided
-            if self.transform:
-                # Convert boxes to a format suitable for albumentations (COCO format)
-                transformed_image = self.transform(image)
-                
-                # Update the data with the transformed image and boxes
-                image = transformed_image
-
-                
-            target['boxes'] = torch.tensor(target['boxes'], dtype=torch.float32)
-            target['labels'] = torch.tensor(target['labels'], dtype=torch.int64)
-            target['image_id'] = torch.tensor(target['labels'], dtype=torch.int64)
-            target['area'] = torch.tensor(target['labels'], dtype=torch.int64)
-            
-            
+            self.image_name = str(self.index.image_names[idx])
+            boxes, codes, width, height = self.index.annotation(idx)
+            # one fresh buffer per key, the targets never alias the index
+            if self.pixel_cache is not None:
+                boxes = boxes * np.tile(self.pixel_cache.scales[idx], 2)
+            else:
+                boxes = boxes.copy()
+            target = build_target(boxes, self.label_lookup[codes], idx)
+
             return (image, target)
         
         except Exception as e:
@@ -94,3 +191,50 @@ class XMLDataset(Dataset):
             print(f"Error: {str(e)}")
             # You can return None or raise the error depending on your need
         return None
+
+    def _load_transformed_image(self, idx, image=None):
+        try:
+            return self.get_transformed_image(idx, image)
+        except Exception as e:
+            print(f"Error loading data for image name {self.index.image_names[idx]}, idx {idx}")
+            print(f"Error: {str(e)}")
+            return None
+
+    def _batch_targets(self, indices):
+        """Targets for several images, built from one concatenated slice of the index."""
+        starts = self.index.offsets[indices]
+        counts = self.index.offsets[np.asarray(indices) + 1] - starts
+        # row r of the batch is object r - first[image] of its image
+        first = np.cumsum(counts) - counts
+        rows = np.arange(counts.sum(), dtype=np.int64) + np.repeat(starts - first, counts)
+
+        boxes = self.index.boxes[rows]
+        if self.pixel_cache is not None:
+            scales = np.repeat(self.pixel_cache.scales[indices], counts, axis=0)
+            boxes *= np.tile(scales, 2)
+        labels = self.label_lookup[self.index.labels[rows]]
+        return build_targets(boxes, labels, counts.tolist(), indices)
+
+    def __getitems__(self, indices):
+        """
+        Batched fetch used by DataLoader: images of the batch are read, decoded
+        and transformed on a thread pool, so even num_workers=0 decodes in
+        parallel, and all targets come from a single pass over the index.
+        """
+        indices = [int(idx) for idx in indices]
+        if not indices:
+            return []
+        if self._decode_pool is None or self._decode_pool_pid != os.getpid():
+            self._decode_pool = ThreadPoolExecutor(max_workers=self.decode_threads)
+            self._decode_pool_pid = os.getpid()
+
+        if self.pixel_cache is not None and self.transform_cache is None:
+            # cached pixels are views of the map, the float conversion runs once
+            # for the whole batch, stacked when the images share a shape
+            images = self._decode_pool.map(
+                self._load_transformed_image, indices, expand_to_rgb([self.pixel_cache.image(idx) for idx in indices])
+            )
+        else:
+            images = self._decode_pool.map(self._load_transformed_image, indices)
+        targets = self._batch_targets(indices)
+        return [None if image is None else (image, target) for image, target in zip(images, targets)]
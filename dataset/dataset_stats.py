@@ -0,0 +1,162 @@
+"""
+Normalisation statistics and label histograms of an image/annotation directory.
+
+Per-channel mean and variance are exact over all pixels of the dataset (not
+the average of per-image values). Every worker reduces a shard of the images
+to (count, mean, M2) partials, chunk of rows by chunk of rows, and the
+partials are merged with Chan et al.'s parallel update. Box-size and class
+histograms are computed from the annotations in the same pass.
+"""
+import hashlib
+import json
+import os
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from PIL import Image
+
+from annotation_index import stat_files
+from manifest import load_pairs
+from voc import parse_voc_xml, select_parser
+
+# bins over sqrt(box area) in pixels
+BOX_SIZE_EDGES = [0, 8, 16, 32, 64, 128, 256, 512, float("inf")]
+CACHE_VERSION = 1
+
+
+def merge_moments(a, b):
+    """Chan et al. merge of two (count, mean, M2) partials."""
+    count_a, mean_a, m2_a = a
+    count_b, mean_b, m2_b = b
+    count = count_a + count_b
+    if count == 0:
+        return a
+    delta = mean_b - mean_a
+    mean = mean_a + delta * (count_b / count)
+    m2 = m2_a + m2_b + delta**2 * (count_a * count_b / count)
+    return count, mean, m2
+
+
+def image_moments(path, chunk_rows=256):
+    """(count, mean, M2) per RGB channel in [0, 1], converting chunk_rows rows at a time."""
+    with Image.open(path) as image:
+        pixels = np.asarray(image.convert("RGB"))
+    moments = (0, np.zeros(3), np.zeros(3))
+    for start in range(0, pixels.shape[0], chunk_rows):
+        chunk = pixels[start : start + chunk_rows].reshape(-1, 3).astype(np.float64) / 255.0
+        mean = chunk.mean(axis=0)
+        moments = merge_moments(moments, (len(chunk), mean, ((chunk - mean) ** 2).sum(axis=0)))
+    return moments
+
+
+def _shard_stats(image_paths, annotation_paths, chunk_rows, parser=None):
+    moments = (0, np.zeros(3), np.zeros(3))
+    box_sizes = np.zeros(len(BOX_SIZE_EDGES) - 1, dtype=np.int64)
+    classes = Counter()
+    for image_path, annotation_path in zip(image_paths, annotation_paths):
+        moments = merge_moments(moments, image_moments(image_path, chunk_rows))
+        if annotation_path is None:
+            continue
+        _, _, _, names, boxes = parse_voc_xml(annotation_path, parser)
+        classes.update(names)
+        boxes = np.array(boxes, dtype=np.float64).reshape(-1, 4)
+        sides = np.sqrt(np.clip((boxes[:, 2] - boxes[:, 0]) * (boxes[:, 3] - boxes[:, 1]), 0, None))
+        box_sizes += np.histogram(sides, bins=BOX_SIZE_EDGES)[0]
+    return moments, box_sizes, classes
+
+
+def _cache_key(image_dir, image_filenames, annotation_dir, annotation_filenames):
+    digest = hashlib.sha1()
+    for directory, filenames in [(image_dir, image_filenames), (annotation_dir, annotation_filenames)]:
+        if directory is None:
+            continue
+        mtimes, sizes = stat_files(directory, filenames)
+        digest.update("\0".join(filenames).encode("utf-8"))
+        digest.update(mtimes.tobytes())
+        digest.update(sizes.tobytes())
+    return f"{CACHE_VERSION}:{digest.hexdigest()}"
+
+
+def collect_dataset_stats(image_dir, annotation_dir=None, workers=None, chunk_rows=256, cache_path=None):
+    """
+    Return a dict with per-channel mean and std, the number of pixels, and if
+    annotation_dir is given box-size and class histograms. Results are cached
+    in cache_path (default <image_dir>.stats.json) keyed by the file list,
+    sizes and mtimes.
+    """
+    if annotation_dir:
+        pairs = load_pairs(image_dir, annotation_dir)
+        image_filenames, annotation_filenames = pairs.image_filenames, pairs.annotation_filenames
+    else:
+        image_filenames, annotation_filenames = sorted(os.listdir(image_dir)), []
+
+    cache_path = cache_path or os.path.normpath(image_dir) + ".stats.json"
+    key = _cache_key(image_dir, image_filenames, annotation_dir, annotation_filenames)
+    try:
+        with open(cache_path) as f:
+            cached = json.load(f)
+        if cached.get("key") == key:
+            return cached["stats"]
+    except (OSError, ValueError):
+        pass
+
+    image_paths = [os.path.join(image_dir, filename) for filename in image_filenames]
+    if annotation_dir:
+        annotation_paths = [os.path.join(annotation_dir, filename) for filename in annotation_filenames]
+        parser = select_parser(annotation_paths)
+    else:
+        annotation_paths = [None] * len(image_paths)
+        parser = None
+
+    # a few shards per worker keeps the pool busy when image sizes vary
+    workers = workers or os.cpu_count() or 1
+    num_shards = max(1, min(len(image_paths), 4 * workers))
+    shards = [
+        (image_paths[i::num_shards], annotation_paths[i::num_shards], chunk_rows, parser) for i in range(num_shards)
+    ]
+    moments = (0, np.zeros(3), np.zeros(3))
+    box_sizes = np.zeros(len(BOX_SIZE_EDGES) - 1, dtype=np.int64)
+    classes = Counter()
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        for shard_moments, shard_box_sizes, shard_classes in executor.map(_shard_stats, *zip(*shards)):
+            moments = merge_moments(moments, shard_moments)
+            box_sizes += shard_box_sizes
+            classes.update(shard_classes)
+
+    count, mean, m2 = moments
+    stats = {
+        "num_images": len(image_paths),
+        "num_pixels": int(count),
+        "mean": mean.tolist(),
+        "std": np.sqrt(m2 / max(count, 1)).tolist(),
+    }
+    if annotation_dir:
+        stats["box_size_edges"] = BOX_SIZE_EDGES[:-1]
+        stats["box_size_counts"] = box_sizes.tolist()
+        stats["class_counts"] = dict(sorted(classes.items()))
+
+    try:
+        with open(cache_path, "w") as f:
+            json.dump({"key": key, "stats": stats}, f, indent=2)
+    except OSError as e:
+        print(f"Could not save dataset stats to {cache_path}: {e}")
+    return stats
+
+
+def compute_dataset_stats(image_dir, workers=None):
+    """Drop-in replacement for the notebooks' helper, returns (mean, std) lists."""
+    stats = collect_dataset_stats(image_dir, workers=workers)
+    return stats["mean"], stats["std"]
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Compute normalisation statistics and label histograms")
+    parser.add_argument("--image-dir", required=True, type=str)
+    parser.add_argument("--annotation-dir", default=None, type=str)
+    parser.add_argument("-j", "--workers", default=None, type=int, help="number of processes (default: cpu count)")
+    parser.add_argument("--chunk-rows", default=256, type=int, help="image rows converted to float at a time")
+    args = parser.parse_args()
+
+    print(json.dumps(collect_dataset_stats(args.image_dir, args.annotation_dir, args.workers, args.chunk_rows), indent=2))
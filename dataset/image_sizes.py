@@ -0,0 +1,28 @@
+import struct
+from PIL import Image
+
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+
+
+def read_png_size(path):
+    """Return (width, height) from the IHDR chunk, or None if path is not a PNG."""
+    with open(path, "rb") as f:
+        header = f.read(24)
+    # signature, IHDR length and type, then big-endian width and height
+    if len(header) < 24 or header[:8] != PNG_SIGNATURE or header[12:16] != b"IHDR":
+        return None
+    return struct.unpack(">II", header[16:24])
+
+
+def read_image_size(path, width=0, height=0):
+    """
+    Image size without decoding pixels: the PNG header when available, else the
+    size recorded in the annotation, else the PIL header.
+    """
+    size = read_png_size(path)
+    if size is not None:
+        return size
+    if width > 0 and height > 0:
+        return width, height
+    with Image.open(path) as image:
+        return image.size
@@ -0,0 +1,184 @@
+import os
+import sqlite3
+import numpy as np
+
+from image_sizes import read_png_size
+
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".bmp")
+ANNOTATION_EXTENSIONS = (".xml",)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS dirs (
+    kind TEXT PRIMARY KEY,
+    path TEXT NOT NULL,
+    mtime_ns INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS files (
+    kind TEXT NOT NULL,
+    name TEXT NOT NULL,
+    stem TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    width INTEGER NOT NULL,
+    height INTEGER NOT NULL,
+    PRIMARY KEY (kind, name)
+);
+"""
+
+
+def default_manifest_path(annotation_dir):
+    return os.path.normpath(annotation_dir) + ".manifest.sqlite"
+
+
+class ManifestPairs:
+    """Image/annotation pairs matched by stem, sorted by annotation filename, as parallel arrays."""
+
+    def __init__(self, rows, unpaired_images, unpaired_annotations):
+        self.image_filenames = [row[0] for row in rows]
+        self.annotation_filenames = [row[1] for row in rows]
+        self.image_mtimes = np.array([row[2] for row in rows], dtype=np.int64)
+        self.image_sizes = np.array([row[3] for row in rows], dtype=np.int64)
+        self.annotation_mtimes = np.array([row[4] for row in rows], dtype=np.int64)
+        self.annotation_sizes = np.array([row[5] for row in rows], dtype=np.int64)
+        # 0 when the image is not a PNG, see image_sizes.read_image_size
+        self.widths = np.array([row[6] for row in rows], dtype=np.int32)
+        self.heights = np.array([row[7] for row in rows], dtype=np.int32)
+        self.unpaired_images = unpaired_images
+        self.unpaired_annotations = unpaired_annotations
+
+    def __len__(self):
+        return len(self.image_filenames)
+
+    @property
+    def image_stats(self):
+        return self.image_mtimes, self.image_sizes
+
+    @property
+    def annotation_stats(self):
+        return self.annotation_mtimes, self.annotation_sizes
+
+
+class Manifest:
+    """
+    Persistent SQLite listing of an image directory and its annotation directory.
+
+    refresh() stats every entry in one os.scandir pass and only re-reads
+    headers of files whose size or mtime changed. With stat_files=False a
+    directory whose own mtime is unchanged (no file added, removed or
+    renamed) is not listed at all; files edited in place do not touch the
+    directory mtime, so the stored stats can then be stale.
+    """
+
+    def __init__(self, image_dir, annotation_dir, path=None):
+        self.image_dir = image_dir
+        self.annotation_dir = annotation_dir
+        self.path = path or default_manifest_path(annotation_dir)
+        try:
+            self.connection = sqlite3.connect(self.path)
+            self.connection.executescript(SCHEMA)
+        except sqlite3.Error as e:
+            # read-only dataset directory, keep the manifest for this process only
+            print(f"Could not open manifest {self.path}: {e}")
+            self.connection = sqlite3.connect(":memory:")
+            self.connection.executescript(SCHEMA)
+
+    def close(self):
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _scan(self, kind, directory, extensions, full, stat_files):
+        directory_mtime = os.stat(directory).st_mtime_ns
+        row = self.connection.execute("SELECT path, mtime_ns FROM dirs WHERE kind = ?", (kind,)).fetchone()
+        if not full and not stat_files and row == (os.path.abspath(directory), directory_mtime):
+            return
+
+        known = {
+            name: (size, mtime_ns)
+            for name, size, mtime_ns in self.connection.execute(
+                "SELECT name, size, mtime_ns FROM files WHERE kind = ?", (kind,)
+            )
+        }
+        if row is not None and row[0] != os.path.abspath(directory):
+            known = {}
+            self.connection.execute("DELETE FROM files WHERE kind = ?", (kind,))
+
+        seen = set()
+        changed = []
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                stem, ext = os.path.splitext(entry.name)
+                if ext.lower() not in extensions or not entry.is_file():
+                    continue
+                seen.add(entry.name)
+                st = entry.stat()
+                if known.get(entry.name) == (st.st_size, st.st_mtime_ns):
+                    continue
+                width, height = (read_png_size(entry.path) or (0, 0)) if kind == "image" else (0, 0)
+                changed.append((kind, entry.name, stem, st.st_size, st.st_mtime_ns, width, height))
+
+        with self.connection:
+            self.connection.executemany("INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?, ?)", changed)
+            self.connection.executemany(
+                "DELETE FROM files WHERE kind = ? AND name = ?", [(kind, name) for name in known.keys() - seen]
+            )
+            self.connection.execute(
+                "INSERT OR REPLACE INTO dirs VALUES (?, ?, ?)", (kind, os.path.abspath(directory), directory_mtime)
+            )
+
+    def refresh(self, full=False, stat_files=True):
+        """
+        Update the listing. stat_files=False skips directories whose mtime is
+        unchanged, full=True lists them anyway.
+        """
+        self._scan("image", self.image_dir, IMAGE_EXTENSIONS, full, stat_files)
+        self._scan("annotation", self.annotation_dir, ANNOTATION_EXTENSIONS, full, stat_files)
+
+    def pairs(self):
+        """
+        Match images to annotations by stem. Mermaid exports images as
+        <stem>-1.png next to <stem>.xml, so that suffix is accepted too.
+        Unmatched files are reported and left out.
+        """
+        annotations = {
+            row[0]: row
+            for row in self.connection.execute(
+                "SELECT stem, name, mtime_ns, size FROM files WHERE kind = 'annotation'"
+            )
+        }
+        rows = []
+        unpaired_images = []
+        for stem, name, mtime_ns, size, width, height in self.connection.execute(
+            "SELECT stem, name, mtime_ns, size, width, height FROM files WHERE kind = 'image' ORDER BY name"
+        ):
+            if stem not in annotations and stem.endswith("-1"):
+                stem = stem[:-2]
+            annotation = annotations.pop(stem, None)
+            if annotation is None:
+                unpaired_images.append(name)
+                continue
+            rows.append((name, annotation[1], mtime_ns, size, annotation[2], annotation[3], width, height))
+        rows.sort(key=lambda row: row[1])
+        unpaired_annotations = sorted(row[1] for row in annotations.values())
+
+        if unpaired_images or unpaired_annotations:
+            print(
+                f"Skipping {len(unpaired_images)} images without annotation in {self.image_dir} "
+                f"{unpaired_images[:5]} and {len(unpaired_annotations)} annotations without image "
+                f"in {self.annotation_dir} {unpaired_annotations[:5]}"
+            )
+        return ManifestPairs(rows, unpaired_images, unpaired_annotations)
+
+
+def load_pairs(image_dir, annotation_dir, path=None, full=False, stat_files=True):
+    """
+    Refresh the manifest of image_dir/annotation_dir and return its ManifestPairs.
+    stat_files=False trusts directory mtimes, see Manifest.
+    """
+    with Manifest(image_dir, annotation_dir, path) as manifest:
+        manifest.refresh(full, stat_files)
+        return manifest.pairs()
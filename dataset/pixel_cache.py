@@ -0,0 +1,253 @@
+import glob
+import os
+import numpy as np
+import torch
+from PIL import Image
+
+from annotation_index import save_arrays, stat_files
+
+
+# PIL mode names: 3-channel, 1-channel grayscale, binarised and bit-packed
+MODES = ("RGB", "L", "1")
+
+
+def default_cache_path(image_dir, max_size=None, mode="RGB"):
+    """
+    Pixels are cached next to the image directory, e.g. train_img.pixels(.npz),
+    grayscale or binary caches as train_img.pixels.L and train_img.pixels.1,
+    and pyramid levels as train_img.pixels@256(.npz).
+    """
+    path = os.path.normpath(image_dir) + ".pixels"
+    if mode != "RGB":
+        path = f"{path}.{mode}"
+    return path if max_size is None else f"{path}@{max_size}"
+
+
+def pyramid_levels(image_dir, mode="RGB"):
+    """max_size of every pyramid level already built for image_dir."""
+    levels = []
+    for table_path in glob.glob(glob.escape(default_cache_path(image_dir, mode=mode)) + "@*.npz"):
+        level = table_path[: -len(".npz")].rsplit("@", 1)[1]
+        if level.isdigit():
+            levels.append(int(level))
+    return sorted(levels)
+
+
+def closest_level(levels, max_size):
+    """Prefer the smallest level at least as large as max_size, so the model only ever downsamples."""
+    larger = [level for level in levels if level >= max_size]
+    if larger:
+        return min(larger)
+    return max(levels) if levels else None
+
+
+def resized_shape(width, height, max_size=None):
+    """(width, height) after scaling the longer side down to max_size, like GeneralizedRCNNTransform."""
+    if max_size is None or max(width, height) <= max_size:
+        return width, height
+    scale = max_size / max(width, height)
+    return max(1, round(width * scale)), max(1, round(height * scale))
+
+
+class PixelCache:
+    """
+    Decoded images of a directory stored back to back in one uint8 file.
+
+    Image i occupies data[offsets[i]:offsets[i] + H * W * C] in HWC order with
+    shape shapes[i] == (H, W, C). The file is memory-mapped copy-on-write, so
+    every DataLoader worker reads the same pages from the page cache and
+    image() returns tensors that are views, not copies.
+
+    A cache built with max_size is one level of a resolution pyramid: images
+    are stored with their longer side resized to max_size and scales[i] holds
+    the (x, y) factors to apply to the boxes of image i.
+
+    mode "L" stores one grayscale channel, mode "1" stores pixels binarised at
+    threshold and packed 8 per byte along each row. Both come back as
+    1-channel uint8 tensors; expand_to_rgb() produces the 3-channel float
+    layout the backbone expects and should run as late as possible.
+    """
+
+    def __init__(
+        self, data_path, filenames, offsets, shapes, scales, mtimes, sizes, mode="RGB", threshold=128, max_size=-1
+    ):
+        self.data_path = data_path
+        # -1 for full resolution
+        self.max_size = int(max_size)
+        self.mode = str(mode)
+        self.threshold = int(threshold)
+        self.filenames = filenames
+        self.offsets = offsets
+        self.shapes = shapes
+        self.scales = scales
+        self.mtimes = mtimes
+        self.sizes = sizes
+        self._data = None
+
+    def __len__(self):
+        return len(self.shapes)
+
+    def __getstate__(self):
+        # never pickle the mapping itself, workers re-open the file lazily
+        state = self.__dict__.copy()
+        state["_data"] = None
+        return state
+
+    @staticmethod
+    def table_path(data_path):
+        return data_path + ".npz"
+
+    @staticmethod
+    def stored_bytes(shapes, mode):
+        height, width = shapes[:, 0], shapes[:, 1]
+        if mode == "1":
+            return height.astype(np.int64) * ((width + 7) // 8)
+        return np.prod(shapes, axis=1, dtype=np.int64)
+
+    @classmethod
+    def build(cls, image_dir, image_filenames, data_path, max_size=None, mode="RGB", threshold=128, stats=None):
+        if mode not in MODES:
+            raise ValueError(f"mode should be one of {MODES}, got {mode}")
+        channels = 3 if mode == "RGB" else 1
+        shapes = np.zeros((len(image_filenames), 3), dtype=np.int32)
+        scales = np.ones((len(image_filenames), 2), dtype=np.float32)
+        for i, filename in enumerate(image_filenames):
+            # PIL only reads the header here
+            with Image.open(os.path.join(image_dir, filename)) as image:
+                width, height = image.size
+            new_width, new_height = resized_shape(width, height, max_size)
+            shapes[i] = (new_height, new_width, channels)
+            scales[i] = (new_width / width, new_height / height)
+
+        offsets = np.zeros(len(image_filenames) + 1, dtype=np.int64)
+        np.cumsum(cls.stored_bytes(shapes, mode), out=offsets[1:])
+
+        tmp_path = f"{data_path}.{os.getpid()}.tmp"
+        data = np.memmap(tmp_path, dtype=np.uint8, mode="w+", shape=(max(int(offsets[-1]), 1),))
+        for i, filename in enumerate(image_filenames):
+            with Image.open(os.path.join(image_dir, filename)) as image:
+                image = image.convert("RGB" if mode == "RGB" else "L")
+                height, width, _ = shapes[i]
+                if image.size != (width, height):
+                    image = image.resize((width, height), Image.BILINEAR)
+                pixels = np.asarray(image)
+                if mode == "1":
+                    pixels = np.packbits(pixels >= threshold, axis=1)
+            data[offsets[i] : offsets[i + 1]] = pixels.reshape(-1)
+        data.flush()
+        del data
+        os.replace(tmp_path, data_path)
+
+        mtimes, sizes = stats if stats is not None else stat_files(image_dir, image_filenames)
+        cache = cls(
+            data_path,
+            np.array(list(image_filenames), dtype=str),
+            offsets,
+            shapes,
+            scales,
+            mtimes,
+            sizes,
+            mode,
+            threshold,
+            -1 if max_size is None else max_size,
+        )
+        # the table is written last, a cache without a table is never trusted
+        save_arrays(
+            cls.table_path(data_path),
+            filenames=cache.filenames,
+            offsets=offsets,
+            shapes=shapes,
+            scales=scales,
+            mtimes=mtimes,
+            sizes=sizes,
+            mode=np.array(mode),
+            threshold=np.array(threshold),
+            max_size=np.array(cache.max_size),
+        )
+        return cache
+
+    @classmethod
+    def load(cls, data_path):
+        with np.load(cls.table_path(data_path), allow_pickle=False) as table:
+            return cls(data_path, **{key: table[key] for key in table.files})
+
+    def is_valid_for(self, image_dir, image_filenames, stats=None):
+        if len(image_filenames) != len(self) or list(self.filenames) != list(image_filenames):
+            return False
+        if os.path.getsize(self.data_path) < self.offsets[-1]:
+            return False
+        mtimes, sizes = stats if stats is not None else stat_files(image_dir, image_filenames)
+        return np.array_equal(mtimes, self.mtimes) and np.array_equal(sizes, self.sizes)
+
+    @classmethod
+    def load_or_build(
+        cls, image_dir, image_filenames, data_path=None, max_size=None, mode="RGB", threshold=128, stats=None
+    ):
+        """
+        Reuse the cache while the source images are unchanged, rebuild it
+        otherwise. stats are the (mtimes, sizes) of the images if known.
+        """
+        data_path = data_path or default_cache_path(image_dir, max_size, mode)
+        if os.path.exists(cls.table_path(data_path)) and os.path.exists(data_path):
+            try:
+                cache = cls.load(data_path)
+                same_storage = (
+                    cache.mode == mode
+                    and (mode != "1" or cache.threshold == threshold)
+                    and cache.max_size == (-1 if max_size is None else max_size)
+                )
+                if same_storage and cache.is_valid_for(image_dir, image_filenames, stats):
+                    return cache
+            except (OSError, ValueError, KeyError, TypeError):
+                pass
+        print(f"Decoding {len(image_filenames)} images from {image_dir} into {data_path}")
+        return cls.build(image_dir, image_filenames, data_path, max_size, mode, threshold, stats)
+
+    def image(self, idx):
+        """
+        Return image idx as a CHW uint8 tensor. RGB and L images are views of
+        the memory map, binary images are unpacked to 0/255 values.
+        """
+        if self._data is None:
+            self._data = np.memmap(self.data_path, dtype=np.uint8, mode="c")
+        height, width, channels = self.shapes[idx]
+        pixels = self._data[self.offsets[idx] : self.offsets[idx + 1]]
+        if self.mode == "1":
+            bits = np.unpackbits(pixels.reshape(height, -1), axis=1, count=width)
+            return torch.from_numpy(bits).mul_(255).unsqueeze(0)
+        return torch.from_numpy(pixels.reshape(height, width, channels)).permute(2, 0, 1)
+
+
+def expand_to_rgb(images, dtype=torch.float32):
+    """
+    Convert a list of CHW uint8 images (1 or 3 channels) to 3-channel images of
+    dtype scaled to [0, 1]. Same-shaped images are converted as one stacked
+    batch, and 1-channel images are converted first and then expanded as a view.
+    """
+    if len(images) > 1 and all(image.shape == images[0].shape for image in images):
+        batch = torch.stack(images).to(dtype).div_(255)
+        return list(batch.expand(-1, 3, -1, -1).unbind(0))
+    return [image.to(dtype).div_(255).expand(3, -1, -1) for image in images]
+
+
+def build_pyramid(image_dir, image_filenames, max_sizes, mode="RGB", threshold=128):
+    """Build (or refresh) one pre-resized pixel cache per size in max_sizes."""
+    return {
+        max_size: PixelCache.load_or_build(image_dir, image_filenames, max_size=max_size, mode=mode, threshold=threshold)
+        for max_size in max_sizes
+    }
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Pre-decode and pre-resize a directory of images")
+    parser.add_argument("--image-dir", required=True, type=str)
+    parser.add_argument(
+        "--max-sizes", default=[256, 299], nargs="+", type=int, help="longer image side of each pyramid level"
+    )
+    parser.add_argument("--mode", default="RGB", choices=MODES, help="RGB, L (grayscale) or 1 (bit-packed binary)")
+    parser.add_argument("--threshold", default=128, type=int, help="binarisation threshold for mode 1")
+    args = parser.parse_args()
+
+    build_pyramid(args.image_dir, sorted(os.listdir(args.image_dir)), args.max_sizes, args.mode, args.threshold)
@@ -0,0 +1,216 @@
+import io
+import json
+import os
+import random
+import tarfile
+import numpy as np
+import torch.distributed as dist
+from PIL import Image
+from torch.utils.data import IterableDataset, get_worker_info
+
+from annotation_index import AnnotationIndex
+from manifest import load_pairs
+from targets import build_target
+from voc import parse_voc_xml
+
+SHARD_INDEX = "shards.json"
+READ_BUFFER_SIZE = 16 * 1024 * 1024
+
+
+def _add_member(tar, name, data):
+    info = tarfile.TarInfo(name)
+    info.size = len(data)
+    tar.addfile(info, io.BytesIO(data))
+
+
+def write_shards(image_dir, annotation_dir, output_dir, shard_size=256 * 1024 * 1024):
+    """
+    Pack (image, annotation) pairs into tar shards of roughly shard_size bytes.
+
+    Pairs are matched by stem like XMLDataset does. Every sample is
+    stored as two consecutive members <key>.png and <key>.xml. The shard list,
+    per-shard sample counts and the label vocabulary are written to shards.json.
+    """
+    pairs = load_pairs(image_dir, annotation_dir)
+    image_filenames, annotation_filenames = pairs.image_filenames, pairs.annotation_filenames
+    label_names = AnnotationIndex.load_or_build(
+        annotation_dir, annotation_filenames, stats=pairs.annotation_stats
+    ).label_names
+
+    os.makedirs(output_dir, exist_ok=True)
+    shards = []
+    tar = None
+    for image_filename, annotation_filename in zip(image_filenames, annotation_filenames):
+        with open(os.path.join(image_dir, image_filename), "rb") as f:
+            image_bytes = f.read()
+        with open(os.path.join(annotation_dir, annotation_filename), "rb") as f:
+            annotation_bytes = f.read()
+
+        sample_size = len(image_bytes) + len(annotation_bytes)
+        if tar is None or (shards[-1]["num_samples"] > 0 and shards[-1]["num_bytes"] + sample_size > shard_size):
+            if tar is not None:
+                tar.close()
+            name = f"shard-{len(shards):06d}.tar"
+            tar = tarfile.open(os.path.join(output_dir, name), "w")
+            start = shards[-1]["start"] + shards[-1]["num_samples"] if shards else 0
+            shards.append({"name": name, "start": start, "num_samples": 0, "num_bytes": 0})
+
+        key, ext = os.path.splitext(image_filename)
+        _add_member(tar, key + ext.lower(), image_bytes)
+        _add_member(tar, key + ".xml", annotation_bytes)
+        shards[-1]["num_samples"] += 1
+        shards[-1]["num_bytes"] += sample_size
+    if tar is not None:
+        tar.close()
+
+    with open(os.path.join(output_dir, SHARD_INDEX), "w") as f:
+        json.dump({"label_names": [str(name) for name in label_names], "shards": shards}, f, indent=2)
+    return shards
+
+
+def _iter_samples(path, first=0, stop=None):
+    """
+    Yield (position, image_bytes, annotation_bytes) of the samples at positions
+    first:stop, reading the tar front to back.
+    """
+    with open(path, "rb", buffering=READ_BUFFER_SIZE) as f, tarfile.open(fileobj=f, mode="r|") as tar:
+        position = 0
+        pending = {}
+        for member in tar:
+            if stop is not None and position >= stop:
+                break
+            if not member.isfile():
+                continue
+            key, ext = os.path.splitext(member.name)
+            # members of samples before first are skipped without being read
+            pending[ext.lower()] = tar.extractfile(member).read() if position >= first else None
+            if ".xml" in pending and len(pending) == 2:
+                annotation_bytes = pending.pop(".xml")
+                _, image_bytes = pending.popitem()
+                if position >= first:
+                    yield position, image_bytes, annotation_bytes
+                position += 1
+
+
+def _sample_ranges(shards, start, stop):
+    """(shard, first, stop) position ranges covering samples start:stop of the shards laid end to end."""
+    ranges = []
+    offset = 0
+    for shard in shards:
+        first, last = max(start, offset), min(stop, offset + shard["num_samples"])
+        if first < last:
+            ranges.append((shard, first - offset, last - offset))
+        offset += shard["num_samples"]
+    return ranges
+
+
+class XMLShardDataset(IterableDataset):
+    """
+    Streams samples written by write_shards with large sequential reads.
+
+    Shards are shuffled with the same seed on every process and laid end to
+    end; every DDP rank reads one contiguous range of len(self) samples of
+    that sequence, split again into contiguous ranges per DataLoader worker.
+    Ranges may start or end inside a shard, so a single shard still feeds
+    every rank and worker, and all ranks yield the same number of samples
+    (the last total % world_size samples of an epoch are left out). Samples
+    are shuffled inside a buffer of shuffle_buffer elements. Call set_epoch()
+    every epoch to vary the order.
+    """
+
+    def __init__(self, shard_dir, label_map=None, transform=None, shuffle_buffer=1000, shuffle_shards=True, seed=0):
+        self.shard_dir = shard_dir
+        with open(os.path.join(shard_dir, SHARD_INDEX)) as f:
+            index = json.load(f)
+        self.shards = index["shards"]
+        label_names = index["label_names"]
+        if label_map is None:
+            self.label_lookup = {name: code + 1 for code, name in enumerate(label_names)}
+        else:
+            self.label_lookup = {name: label_map[name] for name in label_names}
+        self.transform = transform
+        self.shuffle_buffer = shuffle_buffer
+        self.shuffle_shards = shuffle_shards
+        self.seed = seed
+        self.epoch = 0
+
+    def set_epoch(self, epoch):
+        self.epoch = epoch
+
+    @staticmethod
+    def _rank_and_world_size():
+        if dist.is_available() and dist.is_initialized():
+            return dist.get_rank(), dist.get_world_size()
+        return 0, 1
+
+    def __len__(self):
+        # samples yielded by this rank, the same on every rank
+        _, world_size = self._rank_and_world_size()
+        return sum(shard["num_samples"] for shard in self.shards) // world_size
+
+    def _ranges_for_this_process(self):
+        shards = list(self.shards)
+        if self.shuffle_shards:
+            random.Random(self.seed + self.epoch).shuffle(shards)
+        rank, _ = self._rank_and_world_size()
+        per_rank = len(self)
+        start = rank * per_rank
+        worker_info = get_worker_info()
+        if worker_info is not None:
+            worker_id, num_workers = worker_info.id, worker_info.num_workers
+            start, stop = start + per_rank * worker_id // num_workers, start + per_rank * (worker_id + 1) // num_workers
+        else:
+            stop = start + per_rank
+        return _sample_ranges(shards, start, stop)
+
+    def _decode(self, image_id, image_bytes, annotation_bytes):
+        image = Image.open(io.BytesIO(image_bytes)).convert("RGB")
+        _, _, _, names, boxes = parse_voc_xml(io.BytesIO(annotation_bytes))
+        boxes = np.array(boxes, dtype=np.float32).reshape(-1, 4)
+        labels = np.fromiter((self.label_lookup[name] for name in names), dtype=np.int64, count=len(names))
+        target = build_target(boxes, labels, image_id)
+        if self.transform:
+            image = self.transform(image)
+        return image, target
+
+    def _iter_raw(self):
+        for shard, first, stop in self._ranges_for_this_process():
+            path = os.path.join(self.shard_dir, shard["name"])
+            for position, image_bytes, annotation_bytes in _iter_samples(path, first, stop):
+                yield shard["start"] + position, image_bytes, annotation_bytes
+
+    def __iter__(self):
+        rank, _ = self._rank_and_world_size()
+        worker_info = get_worker_info()
+        worker_id = worker_info.id if worker_info is not None else 0
+        rng = random.Random(hash((self.seed, self.epoch, rank, worker_id)))
+
+        # the buffer holds encoded bytes, decoding happens only when a sample leaves it
+        buffer = []
+        for raw in self._iter_raw():
+            if self.shuffle_buffer <= 0:
+                yield self._decode(*raw)
+                continue
+            if len(buffer) < self.shuffle_buffer:
+                buffer.append(raw)
+                continue
+            i = rng.randrange(len(buffer))
+            buffer[i], raw = raw, buffer[i]
+            yield self._decode(*raw)
+        rng.shuffle(buffer)
+        for raw in buffer:
+            yield self._decode(*raw)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Pack a VOC image/annotation directory into tar shards")
+    parser.add_argument("--image-dir", required=True, type=str)
+    parser.add_argument("--annotation-dir", required=True, type=str)
+    parser.add_argument("--output-dir", required=True, type=str)
+    parser.add_argument("--shard-size-mb", default=256, type=int, help="target shard size in MiB")
+    args = parser.parse_args()
+
+    shards = write_shards(args.image_dir, args.annotation_dir, args.output_dir, args.shard_size_mb * 1024 * 1024)
+    print(f"Wrote {sum(s['num_samples'] for s in shards)} samples into {len(shards)} shards in {args.output_dir}")
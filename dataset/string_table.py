@@ -0,0 +1,36 @@
+import numpy as np
+
+
+class StringTable:
+    """
+    Read-only sequence of str stored as one UTF-8 byte buffer plus offsets.
+
+    A Python list of str is one refcounted object per entry, so forked
+    DataLoader workers slowly copy the whole list just by reading it. Two
+    NumPy arrays have no per-entry objects and stay shared copy-on-write.
+    """
+
+    def __init__(self, strings=()):
+        encoded = [string.encode("utf-8") for string in strings]
+        self.offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        np.cumsum(np.array([len(data) for data in encoded], dtype=np.int64), out=self.offsets[1:])
+        self.buffer = np.frombuffer(b"".join(encoded), dtype=np.uint8)
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, idx):
+        if isinstance(idx, slice):
+            return [self[i] for i in range(*idx.indices(len(self)))]
+        if idx < 0:
+            idx += len(self)
+        if not 0 <= idx < len(self):
+            raise IndexError(f"StringTable index {idx} out of range")
+        return self.buffer[self.offsets[idx] : self.offsets[idx + 1]].tobytes().decode("utf-8")
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def __repr__(self):
+        return f"StringTable({len(self)} strings, {self.buffer.nbytes} bytes)"
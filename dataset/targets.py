@@ -0,0 +1,47 @@
+import numpy as np
+import torch
+
+
+def build_targets(boxes, labels, counts, image_ids):
+    """
+    Detection targets of several images from their concatenated objects.
+
+    Args:
+        boxes: (N, 4) float32 [xmin, ymin, xmax, ymax] of all images, owned by
+            the caller (the tensors share its memory).
+        labels: (N,) int64 label ids, owned by the caller as well.
+        counts: Number of objects of every image, in order.
+        image_ids: Id of every image.
+
+    Returns:
+        list: One dict per image with 'boxes', 'labels', 'image_id', 'area' and
+        'iscrowd'. The per-image tensors are views into one buffer per key.
+    """
+    boxes = torch.from_numpy(np.ascontiguousarray(boxes, dtype=np.float32))
+    labels = torch.from_numpy(np.ascontiguousarray(labels, dtype=np.int64))
+    areas = (boxes[:, 2] - boxes[:, 0]).mul_(boxes[:, 3] - boxes[:, 1])
+    iscrowd = torch.zeros(len(labels), dtype=torch.int64)
+    image_ids = torch.as_tensor(image_ids, dtype=torch.int64)
+
+    sections = list(counts)
+    return [
+        {
+            "boxes": image_boxes,
+            "labels": image_labels,
+            "image_id": image_id,
+            "area": image_areas,
+            "iscrowd": image_iscrowd,
+        }
+        for image_id, image_boxes, image_labels, image_areas, image_iscrowd in zip(
+            image_ids,
+            boxes.split(sections),
+            labels.split(sections),
+            areas.split(sections),
+            iscrowd.split(sections),
+        )
+    ]
+
+
+def build_target(boxes, labels, image_id):
+    """Target of a single image, see build_targets."""
+    return build_targets(boxes, labels, [len(labels)], [image_id])[0]
@@ -0,0 +1,215 @@
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+import numpy as np
+import torch
+
+STORAGE_DTYPES = {"float32": torch.float32, "float16": torch.float16, "uint8": torch.uint8}
+
+
+def file_key(path, size, mtime_ns):
+    """
+    Image part of cache keys: a hash of the absolute path, size and mtime of
+    the file, so a key changes whenever the file is replaced or edited
+    without reading its content.
+    """
+    text = f"{os.path.abspath(path)}|{int(size)}|{int(mtime_ns)}"
+    return hashlib.blake2b(text.encode("utf-8"), digest_size=16).hexdigest()
+
+
+def transform_signature(transform, *extra):
+    """
+    Hash of repr(transform) and extra values. torchvision transforms print
+    their parameters, so two pipelines with the same repr produce the same
+    output for the same input as long as they are deterministic.
+    """
+    text = "|".join([repr(transform)] + [repr(value) for value in extra])
+    return hashlib.blake2b(text.encode("utf-8"), digest_size=16).hexdigest()
+
+
+class TransformCache:
+    """
+    Byte-budgeted LRU cache of transformed images, for deterministic
+    pipelines such as the ToTensor() of validation and test splits.
+
+    Floating point outputs are stored as storage and converted back to their
+    dtype on get(): "float16" halves the memory and is approximate, "uint8"
+    quarters it and is exact for outputs that are multiples of 1/255 in
+    [0, 1], like ToTensor() of 8-bit images. Other dtypes are stored as they are.
+
+    With disk_dir, entries are also written there as .npy files and read back
+    on a memory miss, so later evaluation runs and other DataLoader workers
+    share them. Each worker process otherwise has its own memory tier, which
+    only lives across epochs with persistent_workers=True. The files are kept
+    under max_disk_bytes: a put() that goes over it deletes the least recently
+    read files (by atime, which get() refreshes) down to 90% of the budget.
+    """
+
+    def __init__(self, max_bytes=2 << 30, storage="float32", disk_dir=None, max_disk_bytes=16 << 30):
+        if storage not in STORAGE_DTYPES:
+            raise ValueError(f"Unknown storage {storage!r}, choose from {sorted(STORAGE_DTYPES)}")
+        self.max_bytes = max_bytes
+        self.storage = storage
+        self.disk_dir = disk_dir
+        self.max_disk_bytes = max_disk_bytes
+        self.disk_nbytes = 0
+        if disk_dir:
+            os.makedirs(disk_dir, exist_ok=True)
+            self.disk_nbytes = sum(size for _, size, _ in self._disk_entries())
+        self.hits = 0
+        self.misses = 0
+        self.nbytes = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["_lock"] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __repr__(self):
+        return (
+            f"TransformCache({len(self)} entries, {self.nbytes / 2**20:.1f}/{self.max_bytes / 2**20:.1f} MiB, "
+            f"disk {self.disk_nbytes / 2**20:.1f}/{self.max_disk_bytes / 2**20:.1f} MiB, "
+            f"storage={self.storage}, hits={self.hits}, misses={self.misses})"
+        )
+
+    def _encode(self, tensor):
+        if not tensor.is_floating_point() or self.storage == "float32":
+            return tensor, tensor.dtype
+        if self.storage == "float16":
+            return tensor.to(torch.float16), tensor.dtype
+        return tensor.mul(255).round_().clamp_(0, 255).to(torch.uint8), tensor.dtype
+
+    @staticmethod
+    def _decode(stored, dtype):
+        if stored.dtype == dtype:
+            return stored.clone()
+        if stored.dtype == torch.uint8:
+            # lazy rescale, done per get() so memory only holds the uint8 copy
+            return stored.to(dtype).div_(255)
+        return stored.to(dtype)
+
+    def _disk_path(self, key):
+        return os.path.join(self.disk_dir, f"{key}.{self.storage}.npy")
+
+    def _disk_entries(self):
+        """(atime, size, path) of the entry files in disk_dir."""
+        entries = []
+        with os.scandir(self.disk_dir) as it:
+            for entry in it:
+                if not entry.name.endswith(".npy"):
+                    continue
+                try:
+                    stat = entry.stat()
+                except OSError:
+                    # deleted by another worker's eviction
+                    continue
+                entries.append((stat.st_atime, stat.st_size, entry.path))
+        return entries
+
+    def _evict_disk(self):
+        # other workers write and evict in the same directory, so the sizes are
+        # read again instead of trusting disk_nbytes
+        entries = sorted(self._disk_entries())
+        total = sum(size for _, size, _ in entries)
+        # down to 90% so puts at the limit do not rescan every time
+        target = int(self.max_disk_bytes * 0.9)
+        for _, size, path in entries:
+            if total <= target:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                print(f"Could not evict transform cache entry {path}: {e}")
+                continue
+            total -= size
+        with self._lock:
+            self.disk_nbytes = total
+
+    def _insert(self, key, stored, dtype):
+        # called with the lock held
+        if key in self._entries:
+            return
+        size = stored.element_size() * stored.nelement()
+        if size > self.max_bytes:
+            return
+        self._entries[key] = (stored, dtype)
+        self.nbytes += size
+        while self.nbytes > self.max_bytes:
+            _, (evicted, _) = self._entries.popitem(last=False)
+            self.nbytes -= evicted.element_size() * evicted.nelement()
+
+    def get(self, key):
+        """The cached output for key as a new tensor, or None."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._decode(*entry)
+        if self.disk_dir:
+            path = self._disk_path(key)
+            try:
+                with open(path, "rb") as f:
+                    dtype = getattr(torch, np.load(f).item())
+                    stored = torch.from_numpy(np.load(f))
+                # mounts with noatime or relatime would not mark the read
+                os.utime(path)
+            except (OSError, ValueError, AttributeError):
+                pass
+            else:
+                with self._lock:
+                    self.hits += 1
+                    self._insert(key, stored, dtype)
+                return self._decode(stored, dtype)
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def put(self, key, output):
+        """Store a tensor output under key, other outputs are not cached."""
+        if not isinstance(output, torch.Tensor):
+            return
+        stored, dtype = self._encode(output.detach().cpu())
+        if stored.data_ptr() == output.data_ptr():
+            # the caller keeps output and may modify it in place
+            stored = stored.clone()
+        stored = stored.contiguous()
+        with self._lock:
+            self._insert(key, stored, dtype)
+        if self.disk_dir and not os.path.exists(self._disk_path(key)):
+            path = self._disk_path(key)
+            tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            try:
+                with open(tmp_path, "wb") as f:
+                    np.save(f, np.array(str(dtype).split(".")[-1]))
+                    np.save(f, stored.numpy())
+                size = os.path.getsize(tmp_path)
+                if size > self.max_disk_bytes:
+                    os.remove(tmp_path)
+                    return
+                os.replace(tmp_path, path)
+            except OSError as e:
+                print(f"Could not save transform cache entry to {path}: {e}")
+                return
+            with self._lock:
+                self.disk_nbytes += size
+                over = self.disk_nbytes > self.max_disk_bytes
+            if over:
+                self._evict_disk()
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.nbytes = 0
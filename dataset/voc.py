@@ -0,0 +1,243 @@
+"""
+Pascal VOC annotation parsing.
+
+Every backend returns the same (filename, width, height, names, boxes) tuple:
+
+    etree      xml.etree.ElementTree, the reference implementation
+    iterparse  streaming ElementTree, elements are freed as soon as they are read
+    lxml       lxml.etree, only registered when lxml is installed
+    fast       regular expressions over the fixed layout labelImg writes, falls
+               back to etree for anything it does not recognise
+
+select_parser() times the backends on a sample of files, checks them against
+etree and makes the fastest correct one the default of parse_voc_xml.
+"""
+import io
+import os
+import re
+import time
+import xml.etree.ElementTree as ET
+
+try:
+    import lxml.etree as lxml_etree
+except ImportError:
+    lxml_etree = None
+
+# label map used to train the detectors, 0 is reserved for the background
+LABEL_MAP = {
+    "text": 1,
+    "arrow": 2,
+    "connection": 3,
+    "data": 4,
+    "decision": 5,
+    "process": 6,
+    "terminator": 7,
+}
+
+
+def _parse_tree(root):
+    filename = root.findtext("filename")
+
+    size = root.find("size")
+    width = int(size.findtext("width"))
+    height = int(size.findtext("height"))
+
+    names = []
+    boxes = []
+    for obj in root.iter("object"):
+        bndbox = obj.find("bndbox")
+        names.append(obj.findtext("name"))
+        boxes.append(
+            [
+                float(bndbox.findtext("xmin")),
+                float(bndbox.findtext("ymin")),
+                float(bndbox.findtext("xmax")),
+                float(bndbox.findtext("ymax")),
+            ]
+        )
+
+    return filename, width, height, names, boxes
+
+
+def parse_etree(source):
+    return _parse_tree(ET.parse(source).getroot())
+
+
+def parse_lxml(source):
+    return _parse_tree(lxml_etree.parse(source).getroot())
+
+
+_BOX_TAGS = {"xmin": 0, "ymin": 1, "xmax": 2, "ymax": 3}
+
+
+def parse_iterparse(source):
+    filename = None
+    width = height = None
+    names = []
+    boxes = []
+    box = [0.0, 0.0, 0.0, 0.0]
+    path = []
+    for event, elem in ET.iterparse(source, events=("start", "end")):
+        if event == "start":
+            path.append(elem.tag)
+            continue
+        path.pop()
+        tag = elem.tag
+        parent = path[-1] if path else None
+        if tag in _BOX_TAGS and parent == "bndbox":
+            box[_BOX_TAGS[tag]] = float(elem.text)
+        elif tag == "name" and parent == "object":
+            names.append(elem.text)
+        elif tag == "object":
+            boxes.append(box)
+            box = [0.0, 0.0, 0.0, 0.0]
+            elem.clear()
+        elif tag == "filename" and parent == "annotation":
+            filename = elem.text
+        elif tag == "width" and parent == "size":
+            width = int(elem.text)
+        elif tag == "height" and parent == "size":
+            height = int(elem.text)
+    if width is None or height is None:
+        raise ValueError("annotation has no <size>")
+    return filename, width, height, names, boxes
+
+
+_UTF8_RE = re.compile(rb"<\?xml[^>]*encoding=[\"'](?:utf-8|UTF-8)[\"']")
+_FILENAME_RE = re.compile(rb"<filename>([^<&]*)</filename>")
+_SIZE_RE = re.compile(rb"<size>\s*<width>\s*(\d+)\s*</width>\s*<height>\s*(\d+)\s*</height>")
+_OBJECT_RE = re.compile(
+    rb"<object>\s*<name>([^<&]*)</name>.*?<bndbox>\s*"
+    rb"<xmin>([^<]*)</xmin>\s*<ymin>([^<]*)</ymin>\s*<xmax>([^<]*)</xmax>\s*<ymax>([^<]*)</ymax>\s*</bndbox>",
+    re.DOTALL,
+)
+
+
+def parse_fast(source):
+    if hasattr(source, "read"):
+        data = source.read()
+    else:
+        with open(source, "rb") as f:
+            data = f.read()
+
+    filename = _FILENAME_RE.search(data)
+    size = _SIZE_RE.search(data)
+    objects = _OBJECT_RE.findall(data)
+    # anything outside the labelImg layout (comments, CDATA, entities, reordered
+    # or missing tags, objects the pattern skipped) goes through the real parser
+    if (
+        size is None
+        or (filename is None and b"<filename" in data)
+        or (data.startswith(b"<?xml") and b"encoding" in data[: data.find(b"?>")] and not _UTF8_RE.match(data))
+        or b"<!--" in data
+        or b"<![CDATA[" in data
+        or len(objects) != data.count(b"<object>")
+    ):
+        return parse_etree(io.BytesIO(data))
+
+    try:
+        names = [name.decode("utf-8") for name, *_ in objects]
+        boxes = [[float(xmin), float(ymin), float(xmax), float(ymax)] for _, xmin, ymin, xmax, ymax in objects]
+    except ValueError:
+        return parse_etree(io.BytesIO(data))
+    return (
+        filename.group(1).decode("utf-8") if filename else None,
+        int(size.group(1)),
+        int(size.group(2)),
+        names,
+        boxes,
+    )
+
+
+PARSERS = {"etree": parse_etree, "iterparse": parse_iterparse, "fast": parse_fast}
+if lxml_etree is not None:
+    PARSERS["lxml"] = parse_lxml
+
+_default_parser = "etree"
+
+
+def get_default_parser():
+    return _default_parser
+
+
+def set_default_parser(name):
+    global _default_parser
+    if name not in PARSERS:
+        raise ValueError(f"Unknown VOC parser {name!r}, choose from {sorted(PARSERS)}")
+    _default_parser = name
+
+
+def parse_voc_xml(source, parser=None):
+    """
+    Parse a Pascal VOC annotation into plain Python values.
+
+    Args:
+        source: Path or file object of the XML annotation.
+        parser: Name of the backend in PARSERS, the default parser when None.
+
+    Returns:
+        tuple: (filename, width, height, names, boxes) where boxes is a list of
+        [xmin, ymin, xmax, ymax] in the same order as names.
+    """
+    return PARSERS[parser or _default_parser](source)
+
+
+def benchmark_parsers(paths, parsers=None, repeat=3):
+    """
+    Time every parser over paths, best of repeat runs.
+
+    Returns:
+        dict: name -> (seconds per file, correct) where correct means the
+        output equals the etree reference on every file.
+    """
+    reference = [parse_etree(path) for path in paths]
+    results = {}
+    for name in parsers or PARSERS:
+        parse = PARSERS[name]
+        best = float("inf")
+        correct = True
+        for _ in range(repeat):
+            start = time.perf_counter()
+            parsed = [parse(path) for path in paths]
+            best = min(best, time.perf_counter() - start)
+            correct = correct and parsed == reference
+        results[name] = (best / max(len(paths), 1), correct)
+    return results
+
+
+def select_parser(paths, sample=32):
+    """
+    Name of the fastest parser that agrees with etree on a sample of paths,
+    the current default when etree cannot parse them. The default itself is
+    left alone, pass the name to parse_voc_xml.
+    """
+    paths = list(paths)
+    paths = paths[:: max(1, len(paths) // sample)][:sample]
+    if not paths:
+        return _default_parser
+    try:
+        results = benchmark_parsers(paths, repeat=1)
+    except (OSError, ET.ParseError, ValueError, AttributeError):
+        return _default_parser
+    return min((seconds, name) for name, (seconds, correct) in results.items() if correct)[1]
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Benchmark the VOC XML parsers")
+    parser.add_argument("xml_dirs", nargs="*", default=["xml_files/train", "xml_files/val", "xml_files/test"])
+    parser.add_argument("--repeat", default=3, type=int)
+    args = parser.parse_args()
+
+    paths = [
+        os.path.join(xml_dir, filename)
+        for xml_dir in args.xml_dirs
+        for filename in sorted(os.listdir(xml_dir))
+        if filename.endswith(".xml")
+    ]
+    results = benchmark_parsers(paths, repeat=args.repeat)
+    etree_seconds = results["etree"][0]
+    print(f"{len(paths)} files")
+    for name, (seconds, correct) in sorted(results.items(), key=lambda item: item[1][0]):
+        print(f"{name:10s} {seconds * 1e6:8.1f} us/file  {etree_seconds / seconds:5.2f}x  {'ok' if correct else 'MISMATCH'}")
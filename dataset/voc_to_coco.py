@@ -0,0 +1,151 @@
+"""
+Convert the VOC XML annotations of the block diagram dataset to COCO json.
+
+The output follows the layout torchvision_detection/coco_utils.get_coco expects:
+
+    <output-dir>/annotations/instances_train2017.json
+    <output-dir>/annotations/instances_val2017.json
+    <output-dir>/train2017 -> <image-root>/train_img
+    <output-dir>/val2017 -> <image-root>/val_img
+
+Images and annotations are paired by stem and image ids are the positions
+used by XMLDataset. Files whose mtime and
+size did not change since the last run are taken from a per-split cache
+instead of being parsed again.
+"""
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+from image_sizes import read_image_size
+from manifest import load_pairs
+from voc import LABEL_MAP, parse_voc_xml, select_parser
+
+CACHE_VERSION = 1
+
+
+def convert_file(xml_path, image_path, parser=None):
+    """Parse one annotation into an image record with COCO-style [x, y, w, h] boxes."""
+    _, width, height, names, boxes = parse_voc_xml(xml_path, parser)
+    if width <= 0 or height <= 0:
+        # some annotations carry a 0x0 <size>, read it from the image header instead
+        width, height = read_image_size(image_path, width, height)
+    objects = [(name, [xmin, ymin, xmax - xmin, ymax - ymin]) for name, (xmin, ymin, xmax, ymax) in zip(names, boxes)]
+    return {"file_name": os.path.basename(image_path), "width": width, "height": height, "objects": objects}
+
+
+def _convert_file(paths):
+    return convert_file(*paths)
+
+
+def _load_cache(path):
+    try:
+        with open(path) as f:
+            cache = json.load(f)
+        if cache.get("version") == CACHE_VERSION:
+            return cache["files"]
+    except (OSError, ValueError, KeyError):
+        pass
+    return {}
+
+
+def convert_split(xml_dir, image_dir, cache_path=None, label_map=LABEL_MAP, workers=None):
+    """Return the COCO dict for one split, re-parsing only files that changed."""
+    pairs = load_pairs(image_dir, xml_dir)
+    xml_filenames, image_filenames = pairs.annotation_filenames, pairs.image_filenames
+
+    cached = _load_cache(cache_path) if cache_path else {}
+    mtimes, sizes = pairs.annotation_stats
+    records = [None] * len(xml_filenames)
+    todo = []
+    for i, (xml_filename, image_filename) in enumerate(zip(xml_filenames, image_filenames)):
+        entry = cached.get(xml_filename)
+        if (
+            entry is not None
+            and entry["mtime"] == int(mtimes[i])
+            and entry["size"] == int(sizes[i])
+            and entry["record"]["file_name"] == image_filename
+        ):
+            records[i] = entry["record"]
+        else:
+            todo.append(i)
+
+    if todo:
+        xml_paths = [os.path.join(xml_dir, xml_filenames[i]) for i in todo]
+        # chosen here, workers may not inherit the module default
+        parser = select_parser(xml_paths)
+        paths = [(xml_path, os.path.join(image_dir, image_filenames[i]), parser) for xml_path, i in zip(xml_paths, todo)]
+        workers = workers or os.cpu_count() or 1
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            chunksize = max(1, len(paths) // (4 * workers))
+            for i, record in zip(todo, executor.map(_convert_file, paths, chunksize=chunksize)):
+                records[i] = record
+    print(f"{xml_dir}: parsed {len(todo)} changed files, reused {len(records) - len(todo)}")
+
+    if cache_path:
+        files = {
+            xml_filename: {"mtime": int(mtime), "size": int(size), "record": record}
+            for xml_filename, mtime, size, record in zip(xml_filenames, mtimes, sizes, records)
+        }
+        tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"version": CACHE_VERSION, "files": files}, f)
+        os.replace(tmp_path, cache_path)
+
+    images = []
+    annotations = []
+    for image_id, record in enumerate(records):
+        images.append(
+            {"id": image_id, "file_name": record["file_name"], "width": record["width"], "height": record["height"]}
+        )
+        for name, (x, y, w, h) in record["objects"]:
+            annotations.append(
+                {
+                    # annotation IDs need to start at 1, not 0, see torchvision issue #1530
+                    "id": len(annotations) + 1,
+                    "image_id": image_id,
+                    "category_id": label_map[name],
+                    "bbox": [x, y, w, h],
+                    "area": w * h,
+                    "iscrowd": 0,
+                    # box polygon, so the mask conversion in coco_utils also works
+                    "segmentation": [[x, y, x + w, y, x + w, y + h, x, y + h]],
+                }
+            )
+
+    categories = [
+        {"id": idx, "name": name, "supercategory": "block"}
+        for name, idx in sorted(label_map.items(), key=lambda item: item[1])
+    ]
+    return {"images": images, "annotations": annotations, "categories": categories}
+
+
+def main(args):
+    annotations_dir = os.path.join(args.output_dir, "annotations")
+    os.makedirs(annotations_dir, exist_ok=True)
+    for split in args.splits:
+        xml_dir = os.path.join(args.xml_root, split)
+        image_dir = os.path.join(args.image_root, f"{split}_img")
+        cache_path = os.path.join(annotations_dir, f".instances_{split}2017.cache.json")
+        coco = convert_split(xml_dir, image_dir, cache_path, workers=args.workers)
+
+        ann_file = os.path.join(annotations_dir, f"instances_{split}2017.json")
+        with open(ann_file, "w") as f:
+            json.dump(coco, f)
+        print(f"Wrote {len(coco['images'])} images and {len(coco['annotations'])} boxes to {ann_file}")
+
+        img_folder = os.path.join(args.output_dir, f"{split}2017")
+        if not os.path.lexists(img_folder):
+            os.symlink(os.path.abspath(image_dir), img_folder, target_is_directory=True)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Convert VOC XML annotations to COCO json")
+    parser.add_argument("--xml-root", default="xml_files", type=str, help="directory with one folder of XML per split")
+    parser.add_argument("--image-root", default=".", type=str, help="directory with the <split>_img folders")
+    parser.add_argument("--output-dir", default="coco", type=str, help="dataset path to pass to train.py")
+    parser.add_argument("--splits", default=["train", "val"], nargs="+", type=str)
+    parser.add_argument("-j", "--workers", default=None, type=int, help="number of processes (default: cpu count)")
+    main(parser.parse_args())
@@ -119,21 +119,37 @@ def _coco_remove_images_without_annotations(dataset, cat_list=None):
     return dataset
 
 
+def _unwrap_subsets(ds):
+    """Return the innermost dataset and the indices into it of every element of ds."""
+    indices = range(len(ds))
+    while isinstance(ds, torch.utils.data.Subset):
+        indices = [ds.indices[i] for i in indices]
+        ds = ds.dataset
+    return ds, indices
+
+
 def convert_to_coco_api(ds):
     coco_ds = COCO()
     # annotation IDs need to start at 1, not 0, see torchvision issue #1530
     ann_id = 1
     dataset = {"images": [], "categories": [], "annotations": []}
     categories = set()
+    # datasets implementing get_annotations / get_image_info (e.g. XMLDataset)
+    # provide the ground truth without loading and transforming every image
+    base_ds, base_indices = _unwrap_subsets(ds)
+    annotation_only = hasattr(base_ds, "get_annotations") and hasattr(base_ds, "get_image_info")
     for img_idx in range(len(ds)):
-        # find better way to get target
-        # targets = ds.get_annotations(img_idx)
-        img, targets = ds[img_idx]
-        image_id = targets["image_id"]
-        img_dict = {}
-        img_dict["id"] = image_id
-        img_dict["height"] = img.shape[-2]
-        img_dict["width"] = img.shape[-1]
+        if annotation_only:
+            img_dict = dict(base_ds.get_image_info(base_indices[img_idx]))
+            targets = base_ds.get_annotations(base_indices[img_idx])
+            image_id = img_dict["id"]
+        else:
+            img, targets = ds[img_idx]
+            image_id = targets["image_id"]
+            img_dict = {}
+            img_dict["id"] = image_id
+            img_dict["height"] = img.shape[-2]
+            img_dict["width"] = img.shape[-1]
         dataset["images"].append(img_dict)
         bboxes = targets["boxes"].clone()
         bboxes[:, 2:] -= bboxes[:, :2]
@@ -172,14 +188,10 @@ def convert_to_coco_api(ds):
 
 
 def get_coco_api_from_dataset(dataset):
-    # FIXME: This is... awful?
-    for _ in range(10):
-        if isinstance(dataset, torchvision.datasets.CocoDetection):
-            break
-        if isinstance(dataset, torch.utils.data.Subset):
-            dataset = dataset.dataset
-    if isinstance(dataset, torchvision.datasets.CocoDetection):
-        return dataset.coco
+    base_dataset, _ = _unwrap_subsets(dataset)
+    if isinstance(base_dataset, torchvision.datasets.CocoDetection):
+        return base_dataset.coco
+    # keep the Subset so only its images end up in the ground truth
     return convert_to_coco_api(dataset)
 
 
@@ -42,7 +42,10 @@ def copypaste_collate_fn(batch):
 
 def get_dataset(is_train, args):
     image_set = "train" if is_train else "val"
-    num_classes, mode = {"coco": (91, "instances"), "coco_kp": (2, "person_keypoints")}[args.dataset]
+    # blockdiagram: 7 block classes + background, converted with dataset/voc_to_coco.py
+    num_classes, mode = {"coco": (91, "instances"), "coco_kp": (2, "person_keypoints"), "blockdiagram": (8, "instances")}[
+        args.dataset
+    ]
     with_masks = "mask" in args.model
     ds = get_coco(
         root=args.data_path,
@@ -78,7 +81,8 @@ def get_args_parser(add_help=True):
         "--dataset",
         default="coco",
         type=str,
-        help="dataset name. Use coco for object detection and instance segmentation and coco_kp for Keypoint detection",
+        help="dataset name. Use coco for object detection and instance segmentation, coco_kp for Keypoint detection "
+        "and blockdiagram for the block diagram dataset converted with dataset/voc_to_coco.py",
     )
     parser.add_argument("--model", default="maskrcnn_resnet50_fpn", type=str, help="model name")
     parser.add_argument("--device", default="cuda", type=str, help="device (Use cuda or cpu Default: cuda)")
@@ -182,8 +186,8 @@ def get_args_parser(add_help=True):
 def main(args):
     if args.backend.lower() == "tv_tensor" and not args.use_v2:
         raise ValueError("Use --use-v2 if you want to use the tv_tensor backend.")
-    if args.dataset not in ("coco", "coco_kp"):
-        raise ValueError(f"Dataset should be coco or coco_kp, got {args.dataset}")
+    if args.dataset not in ("coco", "coco_kp", "blockdiagram"):
+        raise ValueError(f"Dataset should be coco, coco_kp or blockdiagram, got {args.dataset}")
     if "keypoint" in args.model and args.dataset != "coco_kp":
         raise ValueError("Oops, if you want Keypoint detection, set --dataset coco_kp")
     if args.dataset == "coco_kp" and args.use_v2: